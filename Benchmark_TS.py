@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# Benchmarks the TS searches in algorithms.py on analytic potential energy surfaces instead of VASP.  A single atom is
+# moved between two minima of the surface and each search is charged a simulated cost per energy evaluation.
+
+# usage:  Benchmark_TS.py [-s surfaces] [-m methods] [-t target] [-c cost_in_seconds] [-n noise]
+import os
+import argparse
+import tempfile
+import shutil
+import logging
+import numpy as np
+from pymatgen.core import Structure, Lattice
+import algorithms
+
+BOX = 20.0  # cubic cell length, the surface is centered in the cell
+
+
+def double_well(x, y):
+    """
+    Symmetric double well along x with a 0.5 eV barrier at x = 0 and minima at x = +-1
+    """
+    return 0.5 * (x ** 2 - 1) ** 2 + 0.5 * y ** 2
+
+
+def muller_brown(x, y):
+    """
+    Muller-Brown surface, scaled by 0.01 so barriers are ~1 eV
+    """
+    a = [-200, -100, -170, 15]
+    b = [-1, -1, -6.5, 0.7]
+    c = [0, 0, 11, 0.6]
+    d = [-10, -10, -6.5, 0.7]
+    x0 = [1, 0, -0.5, -1]
+    y0 = [0, 0.5, 1.5, 1]
+    return 0.01 * sum(a[k] * np.exp(b[k] * (x - x0[k]) ** 2 + c[k] * (x - x0[k]) * (y - y0[k]) + d[k] * (y - y0[k]) ** 2)
+                      for k in range(4))
+
+
+def noisy_barrier(x, y):
+    """
+    0.8 eV Gaussian barrier at x = 0 with ~0.05 eV of roughness along the path
+    """
+    return 0.8 * np.exp(-x ** 2 / 0.5) + 0.04 * np.sin(12 * x) + 0.02 * np.sin(29 * x + 1) + 0.5 * y ** 2
+
+
+SURFACES = {'double_well': (double_well, (-1.0, 0.0), (1.0, 0.0)),
+            'muller_brown': (muller_brown, (-0.558, 1.442), (0.623, 0.028)),
+            'noisy_barrier': (noisy_barrier, (-2.0, 0.0), (2.0, 0.0))}
+
+METHODS = {'ternary': lambda target: algorithms.get_ts(0, 4999, 9999, target),
+           'golden': lambda target: algorithms.get_ts_golden(0, 9999, target),
+           'surrogate': lambda target: algorithms.get_ts_surrogate(0, 9999, target)}
+
+
+class AnalyticPES:
+    """
+    Energy backend for algorithms.set_energy_backend.  The energy is surface(x, y) at the position of the first atom
+    (relative to the center of the cell) plus optional gaussian noise.  Every call is charged cost seconds of simulated
+    wall time.
+    """
+
+    def __init__(self, surface, cost=3600.0, noise=0.0, seed=0):
+        self.surface = surface
+        self.cost = cost
+        self.noise = noise
+        self.rng = np.random.RandomState(seed)
+        self.calls = []
+        self.wall_time = 0.0
+
+    def energy(self, x, y):
+        return float(self.surface(x, y))
+
+    def __call__(self, i, structure):
+        x, y = structure[0].coords[0:2] - BOX / 2
+        self.calls.append(i)
+        self.wall_time += self.cost
+        return self.energy(x, y) + (self.rng.normal(0, self.noise) if self.noise else 0.0)
+
+
+def get_structure(position):
+    """
+    Single atom Structure at position (x, y) on the surface
+
+    :param position: (x, y) in Angstrom
+    :return: Structure
+    """
+    return Structure(Lattice.cubic(BOX), ['H'], [[position[0] + BOX / 2, position[1] + BOX / 2, BOX / 2]],
+                     coords_are_cartesian=True)
+
+
+def get_reference_max(pes, start, final, points=10000):
+    """
+    Highest energy along the straight line from start to final
+
+    :return: (fraction along the line, energy)
+    """
+    fractions = np.linspace(0, 1, points)
+    x = start[0] + fractions * (final[0] - start[0])
+    y = start[1] + fractions * (final[1] - start[1])
+    energies = pes.surface(x, y)
+    return fractions[np.argmax(energies)], float(np.max(energies))
+
+
+def benchmark(surface_name, method, target=0.01, cost=3600.0, noise=0.0, seed=0, directory=None):
+    """
+    Run one TS search on one surface in its own directory
+
+    :param surface_name: key of SURFACES
+    :param method: key of METHODS
+    :param target: Convergence criteria passed to the search
+    :param cost: simulated seconds per energy evaluation
+    :param noise: standard deviation (eV) of noise added to every energy
+    :param seed: seed for the noise
+    :param directory: where to make the search folders (Default: temporary directory, removed afterwards)
+    :return: dict of results
+    """
+    surface, start, final = SURFACES[surface_name]
+    pes = AnalyticPES(surface, cost, noise, seed)
+    run_dir = tempfile.mkdtemp() if directory is None else os.path.join(directory, surface_name, method)
+    os.makedirs(run_dir, exist_ok=True)
+    for i, position in [(0, start), (9999, final)]:  # endpoints come from finished relaxations, so are not charged
+        os.makedirs(os.path.join(run_dir, str(i).zfill(4)), exist_ok=True)
+        algorithms.Poscar(get_structure(position)).write_file(os.path.join(run_dir, str(i).zfill(4), 'POSCAR'))
+        with open(os.path.join(run_dir, str(i).zfill(4), 'energy.txt'), 'w') as f:
+            f.write(str(pes.energy(*position)))
+
+    cwd = os.path.abspath('.')
+    algorithms.set_energy_backend(pes)
+    os.chdir(run_dir)
+    try:
+        ts = METHODS[method](target)
+        ts_energy = algorithms.EnergyIndex('.').get(ts)['energy']
+    finally:
+        os.chdir(cwd)
+        algorithms.set_energy_backend(None)
+        if directory is None:
+            shutil.rmtree(run_dir)
+    fraction, reference = get_reference_max(pes, start, final)
+    return {'surface': surface_name, 'method': method, 'calls': len(pes.calls), 'unique': len(set(pes.calls)),
+            'wall_time': pes.wall_time, 'ts': ts, 'ts_energy': ts_energy, 'reference_ts': int(round(fraction * 9999)),
+            'reference_energy': reference}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--surfaces', help='surfaces to run on (default: all)',
+                        nargs='*', choices=sorted(SURFACES), default=sorted(SURFACES))
+    parser.add_argument('-m', '--methods', help='TS searches to compare (default: all)',
+                        nargs='*', choices=sorted(METHODS), default=sorted(METHODS))
+    parser.add_argument('-t', '--target', help='convergence criteria passed to each search (default: 0.01 eV)',
+                        type=float, default=0.01)
+    parser.add_argument('-c', '--cost', help='simulated wall time of one energy evaluation in seconds (default: 3600)',
+                        type=float, default=3600.0)
+    parser.add_argument('-n', '--noise', help='standard deviation of noise added to each energy in eV (default: 0)',
+                        type=float, default=0.0)
+    parser.add_argument('--seed', help='seed for the noise (default: 0)',
+                        type=int, default=0)
+    parser.add_argument('-d', '--directory', help='keep search folders in this directory (default: temporary)',
+                        default=None)
+    parser.add_argument('-v', '--verbose', help='log the searches', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    print('{:<14} {:<10} {:>6} {:>7} {:>10} {:>6} {:>11} {:>6} {:>11}'.format(
+        'surface', 'method', 'calls', 'unique', 'wall (h)', 'ts', 'E_ts', 'ref', 'E_ref'))
+    for surface_name in args.surfaces:
+        for method in args.methods:
+            r = benchmark(surface_name, method, args.target, args.cost, args.noise, args.seed, args.directory)
+            print('{surface:<14} {method:<10} {calls:>6} {unique:>7} {wall_time:>10.1f} {ts:>6} {ts_energy:>11.5f} '
+                  '{reference_ts:>6} {reference_energy:>11.5f}'.format(**dict(r, wall_time=r['wall_time'] / 3600)))
@@ -0,0 +1,290 @@
+# Reads the grids of CHGCAR-like files (CHGCAR, AECCAR0/2, CHG, LOCPOT, ...) straight into numpy arrays, a chunk of
+# lines at a time, without building pymatgen Chgcar objects.  Also streams the chgsum.pl and chgsplit.pl operations.
+# Not meant to be called from command line
+
+import itertools
+import numpy as np
+from pymatgen.io.vasp.inputs import Poscar
+from FileTools import read_chgcar_header
+
+
+class ChgcarReader:
+    """
+    Grids of a CHGCAR-like file, indexed [a, b, c] like Chgcar.data and holding the same values (density times cell
+    volume).  Only the parts asked for are parsed: reading stops after the total density unless the spin density or
+    augmentation occupancies are wanted.
+    """
+
+    def __init__(self, filename='CHGCAR', chunk=100000):
+        """
+        :param filename: file to read
+        :param chunk: number of lines parsed at once
+        """
+        self.filename = filename
+        self.chunk = chunk
+        with open(filename) as f:
+            self.header = read_chgcar_header(f)
+            self.grid_line = f.readline()
+        self.shape = tuple(int(x) for x in self.grid_line.split())
+        if len(self.shape) != 3:
+            raise ValueError('Expected the FFT grid after the structure of {}, got {}'.format(filename, self.grid_line))
+
+    @property
+    def structure(self):
+        return Poscar.from_string(''.join(self.header)).structure
+
+    @property
+    def ngridpts(self):
+        return int(np.prod(self.shape))
+
+    def new_array(self, shape=None, dtype=np.float64, memmap=None):
+        # Uninitialized array in file order (a fastest), in memory or memory-mapped to the file memmap
+        shape = self.shape if shape is None else shape
+        if memmap:
+            return np.memmap(memmap, dtype=dtype, mode='w+', shape=shape, order='F')
+        return np.empty(shape, dtype=dtype, order='F')
+
+    def iter_values(self, f, total):
+        # Parsed values of the next lines of f, a chunk at a time, reading exactly the lines that hold total values
+        first = f.readline()
+        values = np.fromstring(first, dtype=np.float64, sep=' ')
+        per_line = len(values)
+        n = per_line
+        if per_line:
+            yield values
+        while 0 < n < total:
+            lines = list(itertools.islice(iter(f.readline, ''), min(self.chunk, -(-(total - n) // per_line))))
+            values = np.fromstring(''.join(lines), dtype=np.float64, sep=' ')
+            if not lines:
+                break
+            n += len(values)
+            yield values
+        if n != total:
+            raise ValueError('Expected {} values in {}, found {}'.format(total, self.filename, n))
+
+    def read_values(self, f, out):
+        # Fill out (any shape, in file order) with the next values of f
+        flat = out.T.view()
+        flat.shape = (-1,)  # raises instead of copying if out is not in file order
+        n = 0
+        for values in self.iter_values(f, len(flat)):
+            flat[n:n + len(values)] = values
+            n += len(values)
+        return out
+
+    def read_augmentation(self, f):
+        # Augmentation occupancies after a grid, as atom number (1 indexed) -> values; leaves f at the next line
+        augmentation = {}
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line.startswith('augmentation occupancies'):
+                f.seek(position)
+                return augmentation
+            atom, n = (int(x) for x in line.split()[2:4])
+            augmentation[atom] = self.read_values(f, np.empty(n))
+
+    def first_grid(self, f):
+        # Skip the structure and grid line at the top of f
+        read_chgcar_header(f)
+        f.readline()
+
+    def next_grid(self, f):
+        # Skip to just after the next grid line, return False at the end of the file
+        for line in iter(f.readline, ''):
+            if line.split() == self.grid_line.split():
+                return True
+        return False
+
+    def read(self, spin=False, augmentation=False, dtype=np.float64, memmap=None):
+        """
+        :param spin: also read the magnetization density (key diff) if the file has one
+        :param augmentation: also read the augmentation occupancies (key aug, a dict of total and diff)
+        :param dtype: of the arrays, np.float32 halves their memory
+        :param memmap: file to memory-map the total density to (diff goes to memmap + '.diff'), None to keep in memory
+        :return: dict with total, plus diff and aug if asked for
+        """
+        data = {}
+        aug = {}
+        with open(self.filename) as f:
+            self.first_grid(f)
+            data['total'] = self.read_values(f, self.new_array(dtype=dtype, memmap=memmap))
+            if augmentation:
+                aug['total'] = self.read_augmentation(f)
+            if spin and self.next_grid(f):
+                data['diff'] = self.read_values(f, self.new_array(dtype=dtype, memmap=memmap and memmap + '.diff'))
+                if augmentation:
+                    aug['diff'] = self.read_augmentation(f)
+        if augmentation:
+            data['aug'] = aug
+        return data
+
+    def iter_planes(self, planes=1, dtype=np.float64):
+        """
+        Total density a few c planes at a time (the file is in order of c), for reductions over planes without holding
+        the whole grid
+
+        :param planes: number of planes in each block
+        :param dtype: of the blocks
+        :return: iterator of (index of the first plane, (na, nb, planes) block); the block is reused between steps
+        """
+        na, nb, nc = self.shape
+        block = self.new_array((na, nb, planes), dtype)
+        flat = block.T.view()
+        flat.shape = (-1,)
+        size = na * nb * planes
+        start, n = 0, 0  # first plane of the block, values in it so far
+        with open(self.filename) as f:
+            self.first_grid(f)
+            for values in self.iter_values(f, self.ngridpts):
+                while len(values):
+                    used = min(len(values), size - n)
+                    flat[n:n + used] = values[:used]
+                    n += used
+                    values = values[used:]
+                    if n == size or start * na * nb + n == self.ngridpts:
+                        yield start, block[:, :, :n // (na * nb)]
+                        start += planes
+                        n = 0
+
+
+def read_chgcar_data(filename='CHGCAR', **kwargs):
+    """
+    :param filename: CHGCAR-like file
+    :param kwargs: passed to ChgcarReader.read
+    :return: (Structure, data dict as in Chgcar.data)
+    """
+    reader = ChgcarReader(filename)
+    return reader.structure, reader.read(**kwargs)
+
+
+def format_values(values):
+    """
+    Values in the fixed format VASP writes grids in (1X,E17.11: ' 0.12345678901E+01', ' -.12345678901E+01'),
+    formatted with array operations instead of one string format per value
+
+    :param values: flat array
+    :return: (len(values), 18) array of ascii codes, None if an exponent needs three digits
+    """
+    values = np.asarray(values, dtype=np.float64)
+    magnitudes = np.abs(values)
+    exponents = np.zeros(len(values), dtype=np.int32)
+    nonzero = magnitudes > 0
+    exponents[nonzero] = np.floor(np.log10(magnitudes[nonzero])) + 1
+    mantissas = np.rint(magnitudes / 10.0 ** exponents * 1e11)
+    # log10 can be off by one next to powers of ten, or rounding can carry into a 12th digit
+    low = nonzero & (mantissas < 1e10)
+    exponents[low] -= 1
+    high = mantissas >= 1e11
+    exponents[high] += 1
+    if np.any(low | high):
+        mantissas = np.rint(magnitudes / 10.0 ** exponents * 1e11)
+    if np.any(np.abs(exponents) > 99):
+        return None
+    # 11 digits as two int32 halves, which divide much faster than int64
+    upper = (mantissas // 1e5).astype(np.int32)
+    lower = (mantissas - upper * 1e5).astype(np.int32)
+    powers = 10 ** np.arange(5, -1, -1, dtype=np.int32)
+
+    chars = np.empty((len(values), 18), dtype=np.uint8)
+    chars[:, 0] = ord(' ')
+    chars[:, 1] = np.where(values < 0, ord('-'), ord('0'))
+    chars[:, 2] = ord('.')
+    chars[:, 3:9] = upper[:, np.newaxis] // powers % 10 + ord('0')
+    chars[:, 9:14] = lower[:, np.newaxis] // powers[1:] % 10 + ord('0')
+    chars[:, 14] = ord('E')
+    chars[:, 15] = np.where(exponents < 0, ord('-'), ord('+'))
+    chars[:, 16] = np.abs(exponents) // 10 + ord('0')
+    chars[:, 17] = np.abs(exponents) % 10 + ord('0')
+    return chars
+
+
+def format_lines(values, per_line=5):
+    # values as lines of per_line values (the last one may be shorter)
+    chars = format_values(values)
+    if chars is None:
+        return ''.join((' %17.11E' * len(values[i:i + per_line]) + '\n') % tuple(values[i:i + per_line])
+                       for i in range(0, len(values), per_line))
+    full = len(values) // per_line * per_line
+    lines = np.empty((full // per_line, 18 * per_line + 1), dtype=np.uint8)
+    lines[:, :-1] = chars[:full].reshape(-1, 18 * per_line)
+    lines[:, -1] = ord('\n')
+    text = lines.tobytes().decode('ascii')
+    if full < len(values):
+        text += chars[full:].tobytes().decode('ascii') + '\n'
+    return text
+
+
+def write_values(f, chunks, per_line=5):
+    """
+    Write values in the format VASP uses for grids, per_line to a line, continuing lines across chunks
+
+    :param f: open file
+    :param chunks: iterable of flat arrays in file order
+    :param per_line: values on each line
+    :return: number of values written
+    """
+    carry = np.empty(0)
+    n = 0
+    for values in chunks:
+        values = np.concatenate([carry, values]) if len(carry) else values
+        full = len(values) // per_line * per_line
+        f.write(format_lines(values[:full], per_line))
+        carry = values[full:].copy()
+        n += full
+    f.write(format_lines(carry, per_line))
+    return n + len(carry)
+
+
+def iter_flat_planes(reader, planes=16):
+    # Blocks of iter_planes as flat arrays in file order
+    for _, block in reader.iter_planes(planes):
+        yield block.T.reshape(-1)
+
+
+def chgsum(first='AECCAR0', second='AECCAR2', output='CHGCAR_sum', planes=16):
+    """
+    Sum of two grids on the same FFT grid (chgsum.pl), reading both files a few planes at a time
+
+    :param first: CHGCAR-like file, its structure is written to output
+    :param second: CHGCAR-like file
+    :param output: file to write
+    :param planes: number of c planes held in memory from each file
+    :return: output
+    """
+    reader_1, reader_2 = ChgcarReader(first), ChgcarReader(second)
+    if reader_1.shape != reader_2.shape:
+        raise ValueError('{} and {} have different FFT grids: {} and {}'.format(first, second, reader_1.shape,
+                                                                                reader_2.shape))
+    with open(output, 'w') as f:
+        f.writelines(reader_1.header)
+        f.write(reader_1.grid_line)
+        write_values(f, (values_1 + values_2 for values_1, values_2 in
+                         zip(iter_flat_planes(reader_1, planes), iter_flat_planes(reader_2, planes))))
+    return output
+
+
+def chgsplit(chgcar='CHGCAR', total='CHGCAR_tot', mag='CHGCAR_mag'):
+    """
+    Split a spin polarized CHGCAR into its total and magnetization densities (chgsplit.pl), in one streaming pass
+
+    :param chgcar: spin polarized CHGCAR
+    :param total: file to write the total density to
+    :param mag: file to write the magnetization density to
+    :return: (total, mag)
+    """
+    reader = ChgcarReader(chgcar)
+
+    def copy_grid(f, output):
+        with open(output, 'w') as f_out:
+            f_out.writelines(reader.header)
+            f_out.write(reader.grid_line)
+            write_values(f_out, reader.iter_values(f, reader.ngridpts))
+
+    with open(chgcar) as f:
+        reader.first_grid(f)
+        copy_grid(f, total)
+        if not reader.next_grid(f):
+            raise ValueError('{} has no magnetization density'.format(chgcar))
+        copy_grid(f, mag)
+    return total, mag
@@ -8,6 +8,9 @@ from pymatgen.io.vasp.outputs import Vasprun
 import Dim_Check
 from pymatgen.core import Structure, PeriodicSite
 import numpy as np
+from OutcarScanner import OutcarScanner
+from ChgcarReader import chgsum, chgsplit
+from concurrent.futures import ProcessPoolExecutor
 
 class NEBNotTerminating(FrozenJobErrorHandler):
 
@@ -21,17 +24,16 @@ class NEBWalltimeHandler(WalltimeHandler):
         if self.wall_time:
             run_time = datetime.datetime.now() - self.start_time
             total_secs = run_time.total_seconds()
-            outcar = Outcar("01/OUTCAR")
+            if getattr(self, 'outcar', None) is None:  # kept between checks so only new lines are read
+                self.outcar = OutcarScanner("01/OUTCAR")
+            self.outcar.scan()
             if not self.electronic_step_stop:
                 # Determine max time per ionic step.
-                outcar.read_pattern({"timings": "LOOP\+.+real time(.+)"},
-                                    postprocess=float)
-                time_per_step = np.max(outcar.data.get('timings')) if outcar.data.get("timings", []) else 0
+                timings = self.outcar.loop_plus_times
             else:
                 # Determine max time per electronic step.
-                outcar.read_pattern({"timings": "LOOP:.+real time(.+)"},
-                                    postprocess=float)
-                time_per_step = np.max(outcar.data.get('timings')) if outcar.data.get("timings", []) else 0
+                timings = self.outcar.loop_times
+            time_per_step = np.max(timings) if timings else 0
 
             # If the remaining time is less than average time for 3
             # steps or buffer_time.
@@ -146,23 +148,8 @@ class NEBJob(VaspJob):
     def postprocess(self):
         VaspJob.postprocess(self)
         images = Incar.from_file('INCAR')['IMAGES']
-        is_magnetic = ('ISPIN' in Incar.from_file('INCAR')) and (Incar.from_file('INCAR')['ISPIN'] == 2)
-        cwd = os.path.abspath('.')
-        for i in range(images+2):
-            dir = str(i).zfill(2)
-            os.chdir(dir)
-            if os.path.exists('AECCAR0') and os.path.exists('AECCAR2') and os.path.exists('CHGCAR'):
-                os.system('chgsum.pl AECCAR0 AECCAR2 &> bader_info')
-                if is_magnetic:
-                    os.system('chgsplit.pl CHGCAR &>> bader_info ; bader CHGCAR_mag -ref CHGCAR_sum &>> bader_info')
-                    try:
-                        shutil.copy('ACF.dat', 'ACF_mag.dat')
-                        shutil.copy('AVF.dat', 'AVF_mag.dat')
-                        shutil.copy('BCF.dat', 'BCF_mag.dat')
-                    except:
-                        pass
-                os.system('bader CHGCAR -ref CHGCAR_sum &>> bader_info')
-            os.chdir(cwd)
+        run_bader_images([str(i).zfill(2) for i in range(images+2)], is_spin_polarized('INCAR'),
+                         int(os.environ['VASP_BADER_PROCESSES']) if 'VASP_BADER_PROCESSES' in os.environ else None)
 
 class DimerJob(VaspJob):
     def setup(self):
@@ -230,30 +217,67 @@ class DimerJob(VaspJob):
         if make:
             print('Creating Mins')
             Dim_Check.check_dimer(os.path.abspath('.'), True)
-        if os.path.exists('AECCAR0') and os.path.exists('AECCAR2') and os.path.exists('CHGCAR'):
-            os.system('chgsum.pl AECCAR0 AECCAR2 &> bader_info')
-            if 'ISPIN' in Incar.from_file('INCAR') and Incar.from_file('INCAR')['ISPIN'] == 2:
-                os.system('chgsplit.pl CHGCAR &>> bader_info ; bader CHGCAR_mag -ref CHGCAR_sum &>> bader_info')
+        bader_folder('.', is_spin_polarized('INCAR'))
+
+def is_spin_polarized(incar_file='INCAR'):
+    incar = Incar.from_file(incar_file)
+    return 'ISPIN' in incar and incar['ISPIN'] == 2
+
+def bader_folder(folder='.', is_magnetic=False):
+    """
+    Bader analysis of a finished run: AECCAR0 + AECCAR2 summed into CHGCAR_sum as the reference, then bader on CHGCAR
+    (and on CHGCAR_mag, with results copied to *_mag.dat, for magnetic runs).  Output of bader goes to bader_info.
+
+    :param folder: run folder
+    :param is_magnetic: also split CHGCAR and analyse the magnetization density
+    :return: True if the analysis ran
+    """
+    if not all(os.path.exists(os.path.join(folder, f)) for f in ['AECCAR0', 'AECCAR2', 'CHGCAR']):
+        return False
+    with open(os.path.join(folder, 'bader_info'), 'w') as bader_info:
+        try:
+            chgsum(os.path.join(folder, 'AECCAR0'), os.path.join(folder, 'AECCAR2'),
+                   os.path.join(folder, 'CHGCAR_sum'))
+            if is_magnetic:
+                chgsplit(os.path.join(folder, 'CHGCAR'), os.path.join(folder, 'CHGCAR_tot'),
+                         os.path.join(folder, 'CHGCAR_mag'))
+                subprocess.call(['bader', 'CHGCAR_mag', '-ref', 'CHGCAR_sum'], cwd=folder, stdout=bader_info,
+                                stderr=subprocess.STDOUT)
                 try:
-                    shutil.copy('ACF.dat', 'ACF_mag.dat')
-                    shutil.copy('AVF.dat', 'AVF_mag.dat')
-                    shutil.copy('BCF.dat', 'BCF_mag.dat')
+                    for f in ['ACF', 'AVF', 'BCF']:
+                        shutil.copy(os.path.join(folder, f + '.dat'), os.path.join(folder, f + '_mag.dat'))
                 except:
                     pass
-            os.system('bader CHGCAR -ref CHGCAR_sum &>> bader_info')
+            subprocess.call(['bader', 'CHGCAR', '-ref', 'CHGCAR_sum'], cwd=folder, stdout=bader_info,
+                            stderr=subprocess.STDOUT)
+        except (OSError, ValueError) as e:
+            bader_info.write('{}: {}\n'.format(type(e).__name__, e))
+            logging.error('Bader analysis of {} failed: {}'.format(folder, e))
+            return False
+    return True
+
+def run_bader_images(folders, is_magnetic=False, processes=None):
+    """
+    bader_folder on many folders (images of an NEB) at once
+
+    :param folders: run folders
+    :param is_magnetic: also analyse the magnetization densities
+    :param processes: most folders analysed at once (Default: number of cpus)
+    :return: list of bader_folder results (or the exception raised), one per folder
+    """
+    results = []
+    with ProcessPoolExecutor(min(processes or os.cpu_count(), len(folders)) or 1) as pool:
+        futures = [pool.submit(bader_folder, folder, is_magnetic) for folder in folders]
+        for folder, future in zip(folders, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logging.error('Bader analysis of {} failed: {}'.format(folder, e))
+                results.append(e)
+    return results
 
 def run_bader(VaspJob):
-        if os.path.exists('AECCAR0') and os.path.exists('AECCAR2') and os.path.exists('CHGCAR'):
-            os.system('chgsum.pl AECCAR0 AECCAR2 &> bader_info')
-            if 'ISPIN' in Incar.from_file('INCAR') and Incar.from_file('INCAR')['ISPIN'] == 2:
-                os.system('chgsplit.pl CHGCAR &>> bader_info ; bader CHGCAR_mag -ref CHGCAR_sum &>> bader_info')
-                try:
-                    shutil.copy('ACF.dat', 'ACF_mag.dat')
-                    shutil.copy('AVF.dat', 'AVF_mag.dat')
-                    shutil.copy('BCF.dat', 'BCF_mag.dat')
-                except:
-                    pass
-            os.system('bader CHGCAR -ref CHGCAR_sum &>> bader_info')
+        bader_folder('.', is_spin_polarized('INCAR'))
 
 
 class StandardJob(VaspJob):
@@ -4,9 +4,12 @@ from pymatgen.io.vasp.inputs import *
 from pymatgen.io.vasp.outputs import *
 import pymatgen as pmg
 import numpy as np
+import os
+import itertools
 import cfg
 import subprocess
 from pymatgen.io.vasp.inputs import Incar as old_Incar
+from pymatgen.core import Lattice, Structure, Composition
 
 def get_string_more_sigfig(self, direct=True, vasp4_compatible=False, significant_figures=20):
     """
@@ -178,7 +181,9 @@ class VaspNEBInput(VaspInput):
         if make_dir_if_not_present and not os.path.exists(output_dir):
             os.makedirs(output_dir)
         for k, v in self.items():
-            if k == 'POSCARs':
+            if k == 'POSCARs' and isinstance(v, NEBPath):
+                v.write_poscars(output_dir)
+            elif k == 'POSCARs':
                 for i in range(len(v)):
                     if not os.path.exists(os.path.join(output_dir, str(i).zfill(2))):
                         os.mkdir(os.path.join(output_dir, str(i).zfill(2)))
@@ -189,7 +194,7 @@ class VaspNEBInput(VaspInput):
                     f.write(v.__str__())
 
     @staticmethod
-    def from_directory(input_dir, check_CONTCAR=False, optional_files=None):
+    def from_directory(input_dir, check_CONTCAR=False, optional_files=None, as_path=False):
         """
         Read in a set of VASP NEB input from a directory. Note that only the
         standard INCAR, POSCARs, POTCAR and KPOINTS files are read unless
@@ -198,6 +203,7 @@ class VaspNEBInput(VaspInput):
         Args:
             input_dir (str): Directory to read VASP input from.
             check_CONTCAR : uses CONTCARs instead of POSCARS if they are available
+            as_path : read the images into one NEBPath instead of a list of PoscarNEBs
             optional_files (dict): Optional files to read in as well as a
                 dict of {filename: Object type}. Object type must have a
                 static method from_file.
@@ -227,7 +233,8 @@ class VaspNEBInput(VaspInput):
                     poscars.append(PoscarNEB.from_file(os.path.join(image[1], 'POSCAR')))
             else:
                 poscars.append(PoscarNEB.from_file(os.path.join(image[1], 'POSCAR')))
-        sub_d['poscars'] = poscars
+        sub_d['poscars'] = NEBPath.from_structures([p.structure for p in poscars], poscars[0].selective_dynamics) \
+            if as_path else poscars
         sub_d["optional_files"] = {}
         if optional_files is not None:
             for fname, ftype in optional_files.items():
@@ -448,6 +455,166 @@ class PoscarNEB(Poscar):
         """
         return self.get_string(significant_figures=20)
 
+class NEBPath(MSONable):
+    """
+    Images of a path stored as one (n_images, n_atoms, 3) float64 array of cartesian coordinates, sharing a lattice,
+    species list and selective dynamics.  Indexing with an int gives a Structure, slicing gives an NEBPath viewing the
+    same coordinates.
+    """
+
+    def __init__(self, lattice, species, coords, selective_dynamics=None):
+        self.lattice = lattice if isinstance(lattice, Lattice) else Lattice(lattice)
+        self.species = [str(s) for s in species]
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self.selective_dynamics = None if selective_dynamics is None else np.array(selective_dynamics, dtype=bool)
+
+    @staticmethod
+    def from_structures(structures, selective_dynamics=None):
+        """
+        :param structures: list of Structures with the same sites in the same order
+        :param selective_dynamics: (n_atoms, 3) (Default: selective_dynamics site property of the first structure)
+        """
+        if selective_dynamics is None:
+            selective_dynamics = structures[0].site_properties.get('selective_dynamics')
+        return NEBPath(structures[0].lattice, [site.species_string for site in structures[0]],
+                       [s.cart_coords for s in structures], selective_dynamics)
+
+    @staticmethod
+    def from_directory(input_dir, check_CONTCAR=False):
+        """
+        Reads the POSCARs (or CONTCARs) of the numbered image folders of an NEB
+
+        :param input_dir: NEB directory
+        :param check_CONTCAR: uses CONTCARs instead of POSCARs if they are available
+        """
+        poscars = []
+        for d in sorted([d for d in os.listdir(input_dir) if d.isdigit() and os.path.isdir(os.path.join(input_dir, d))],
+                        key=int):
+            contcar = os.path.join(input_dir, d, 'CONTCAR')
+            if check_CONTCAR and os.path.exists(contcar) and os.path.getsize(contcar) > 0:
+                poscars.append(Poscar.from_file(contcar, check_for_POTCAR=False))
+            else:
+                poscars.append(Poscar.from_file(os.path.join(input_dir, d, 'POSCAR'), check_for_POTCAR=False))
+        return NEBPath.from_structures([p.structure for p in poscars], poscars[0].selective_dynamics)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return NEBPath(self.lattice, self.species, self.coords[item], self.selective_dynamics)
+        return self.get_structure(item)
+
+    def __iter__(self):
+        return (self.get_structure(i) for i in range(len(self)))
+
+    @property
+    def natoms(self):
+        return len(self.species)
+
+    @property
+    def frac_coords(self):
+        return np.dot(self.coords, self.lattice.inv_matrix)
+
+    def get_structure(self, i):
+        site_properties = None
+        if self.selective_dynamics is not None:
+            site_properties = {'selective_dynamics': self.selective_dynamics.tolist()}
+        return Structure(self.lattice, self.species, self.coords[i], coords_are_cartesian=True,
+                         site_properties=site_properties)
+
+    def get_sub_path(self, start, end, nimages=None):
+        """
+        Path from image start to image end (inclusive), optionally linearly reinterpolated to nimages intervals
+
+        :return: NEBPath
+        """
+        sub_path = NEBPath(self.lattice, self.species, self.coords[start:end + 1].copy(), self.selective_dynamics)
+        if nimages is not None:
+            n = np.linspace(0, 1, nimages + 1)[:, np.newaxis, np.newaxis]
+            sub_path.coords = sub_path.coords[0] + n * (sub_path.coords[-1] - sub_path.coords[0])
+        return sub_path
+
+    def get_image(self, fraction, idpp=True):
+        """
+        Structure at fraction along the line from the first image to the nearest periodic image of the last
+
+        :param fraction: 0 to 1
+        :param idpp: relax the image with IDPP perpendicular to the line
+        :return: Structure
+        """
+        step = np.dot(self.coords[-1] - self.coords[0], self.lattice.inv_matrix)
+        final = self.coords[0] + np.dot(step - np.round(step), self.lattice.matrix)
+        if idpp:
+            from IDPP import idpp_image
+            mask = None if self.selective_dynamics is None else self.selective_dynamics.astype(float)
+            coords = idpp_image(self.coords[0], final, fraction, self.lattice.matrix, mask)
+        else:
+            coords = self.coords[0] + fraction * (final - self.coords[0])
+        return NEBPath(self.lattice, self.species, coords[np.newaxis], self.selective_dynamics)[0]
+
+    def unwrap(self):
+        """
+        Moves every atom of every image to the periodic image nearest its position in the previous image, so the path is
+        continuous
+        """
+        frac = self.frac_coords
+        steps = np.diff(frac, axis=0)
+        frac[1:] = frac[0] + np.cumsum(steps - np.round(steps), axis=0)
+        self.coords = np.dot(frac, self.lattice.matrix)
+        return self
+
+    @property
+    def site_symbols(self):
+        return [s for i, s in enumerate(self.species) if i == 0 or s != self.species[i - 1]]
+
+    def get_poscar_strings(self, significant_figures=20):
+        """
+        POSCAR of every image, formatted as Poscar.get_string (direct coordinates)
+        """
+        latt = self.lattice
+        if np.linalg.det(latt.matrix) < 0:
+            latt = Lattice(-latt.matrix)
+        fl = "%." + str(significant_figures) + "f"
+        natoms = [len(list(g)) for _, g in itertools.groupby(self.species)]
+        header = [Composition(' '.join(self.species)).formula, "1.0",
+                  "\n".join([" ".join([fl % i for i in row]) for row in latt.matrix]),
+                  " ".join(self.site_symbols), " ".join([str(x) for x in natoms])]
+        if self.selective_dynamics is not None:
+            header.append("Selective dynamics")
+        header.append("direct")
+        tail = [" " + s for s in self.species]
+        if self.selective_dynamics is not None:
+            tail = [" " + " ".join("T" if j else "F" for j in sd) + t for sd, t in zip(self.selective_dynamics, tail)]
+        line = " ".join([fl] * 3)
+        return ["\n".join(header + [line % tuple(c) + t for c, t in zip(image, tail)]) + "\n"
+                for image in self.frac_coords]
+
+    def write_poscars(self, output_dir='.', start_i=0, filename='POSCAR'):
+        """
+        Writes image i to output_dir/{i+start_i:02d}/filename
+        """
+        for i, string in enumerate(self.get_poscar_strings()):
+            folder = os.path.join(output_dir, str(i + start_i).zfill(2))
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, filename), 'w') as f:
+                f.write(string)
+
+    def write_xyz(self, filename, mark_frozen=False):
+        """
+        Writes every image to one xyz file
+
+        :param mark_frozen: append "X" to atoms frozen by selective dynamics (as GSM expects)
+        """
+        tail = ['\n'] * self.natoms
+        if mark_frozen and self.selective_dynamics is not None:
+            tail = [' "X"\n' if not sd.any() else '\n' for sd in self.selective_dynamics]
+        with open(filename, 'w') as f:
+            for image in self.coords:
+                f.write('{}\n\n'.format(self.natoms))
+                f.writelines(['{} {:.10f} {:.10f} {:.10f}{}'.format(s, *c, t)
+                              for s, c, t in zip(self.species, image, tail)])
+
 class Modecar(MSONable):
 
     def __init__(self, contents):
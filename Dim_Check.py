@@ -10,6 +10,7 @@ import sys
 import subprocess
 import argparse
 from Classes_Pymatgen import *
+from FileTools import seed_file
 
 def check_dimer(directory, runP=False):
     directory = os.path.abspath(directory)
@@ -22,13 +23,13 @@ def check_dimer(directory, runP=False):
         dir = os.path.join(directory, 'mins', m)
         try:
             print('Copying WAVECAR to ' + m),
-            shutil.copy(os.path.join(directory, 'WAVECAR'), dir)
+            seed_file(os.path.join(directory, 'WAVECAR'), dir)
             print('Done')
         except:
             print('Failed')
         try:
             print('Copying CHGCAR to ' + m),
-            shutil.copy(os.path.join(directory, 'CHGCAR'), dir)
+            seed_file(os.path.join(directory, 'CHGCAR'), dir)
             print('Done')
         except:
             print('Failed')
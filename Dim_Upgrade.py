@@ -10,6 +10,7 @@ import sys
 import subprocess
 import argparse
 from Classes_Pymatgen import *
+from FileTools import seed_file
 
 def check_dimer(directory, runP=False):
     directory = os.path.abspath(directory)
@@ -37,13 +38,13 @@ def check_dimer(directory, runP=False):
             for f in ['WAVECAR', 'CHGCAR']:
                 print('Copying Min ' + f + ' for ' + m),
                 try:
-                    shutil.copy(os.path.join(min_dir, f), os.path.join(mep_min_folder, f))
+                    seed_file(os.path.join(min_dir, f), os.path.join(mep_min_folder, f))
                     print('Done')
                 except:
                     print('Failed')
                 print('Copying TS ' + f + ' for ' + m),
                 try:
-                    shutil.copy(f, os.path.join(mep_ts_folder, f))
+                    seed_file(f, os.path.join(mep_ts_folder, f))
                     print('Done')
                 except:
                     print('Failed')
@@ -60,7 +61,7 @@ def check_dimer(directory, runP=False):
             for f in ['WAVECAR', 'CHGCAR']:
                 print('Copying TS ' + f + ' for ' + m),
                 try:
-                    shutil.copy(f, os.path.join(mep_ts_folder, f))
+                    seed_file(f, os.path.join(mep_ts_folder, f))
                     print('Done')
                 except:
                     print('Failed')
@@ -0,0 +1,204 @@
+# Functions for moving large VASP files (WAVECAR, CHGCAR, ...) between run folders
+# Not meant to be called from command line
+
+import os
+import shutil
+import logging
+import numpy as np
+
+FICLONE = 0x40049409  # linux/fs.h, fcntl.FICLONE is only exposed in python >= 3.12
+
+
+def reflink(src, dst):
+    """
+    Make dst a copy-on-write clone of src (btrfs, XFS, ZFS, ...).  The two files share data blocks until one of them is
+    written to.
+
+    :param src: existing file
+    :param dst: file to create
+    :return: True if the clone was made
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), getattr(fcntl, 'FICLONE', FICLONE), f_src.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dst)
+    return False
+
+
+def kernel_copy(src, dst):
+    """
+    Copy src to dst with copy_file_range, which never passes the data through python and lets the filesystem do a
+    server-side copy or clone where it can (NFS 4.2, Lustre, CIFS, XFS, ...)
+
+    :param src: existing file
+    :param dst: file to create
+    :return: True if the copy was made
+    """
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        remaining = os.fstat(f_src.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(f_src.fileno(), f_dst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError:
+            remaining = -1
+    if remaining == 0:
+        return True
+    os.remove(dst)
+    return False
+
+
+def seed_file(src, dst, hardlink=False):
+    """
+    Put a copy of src at dst as cheaply as the filesystem allows, in order: hardlink (only if asked for), copy-on-write
+    clone, in-kernel copy, regular copy.
+
+    Hardlinks share the file itself, and VASP rewrites WAVECAR and CHGCAR in place, so only ask for them when dst will
+    never be written to.
+
+    :param src: existing file
+    :param dst: file or directory to put the copy in (replaced if it exists)
+    :param hardlink: allow dst to be a hardlink to src
+    :return: path of the new file
+    """
+    if not os.path.isfile(src):
+        raise FileNotFoundError(src)
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return dst
+        os.remove(dst)
+    if hardlink:
+        try:
+            os.link(src, dst)
+            logging.debug('Linked {} to {}'.format(src, dst))
+            return dst
+        except OSError:
+            pass
+    if reflink(src, dst):
+        logging.debug('Cloned {} to {}'.format(src, dst))
+    elif kernel_copy(src, dst):
+        logging.debug('Copied {} to {} in kernel'.format(src, dst))
+    else:
+        shutil.copyfile(src, dst)
+        logging.debug('Copied {} to {}'.format(src, dst))
+    shutil.copymode(src, dst)
+    return dst
+
+
+def seed_tree(src, dst, hardlink=False):
+    """
+    seed_file every file in the directory src into dst, like shutil.copytree
+
+    :param src: existing directory
+    :param dst: directory to create (must not exist)
+    :param hardlink: allow files to be hardlinked (see seed_file)
+    :return: dst
+    """
+    os.makedirs(dst)
+    for root, dirs, files in os.walk(src):
+        for d in dirs:
+            os.makedirs(os.path.join(dst, os.path.relpath(os.path.join(root, d), src)), exist_ok=True)
+        for f in files:
+            seed_file(os.path.join(root, f), os.path.join(dst, os.path.relpath(os.path.join(root, f), src)), hardlink)
+    return dst
+
+
+def read_chgcar_header(f):
+    # Lines of the structure at the top of a CHGCAR, up to and including the blank line before the grid
+    lines = []
+    for line in iter(f.readline, ''):  # not next(f), which would disable f.tell()
+        lines.append(line)
+        if not line.strip() and len(lines) > 7:
+            return lines
+    raise ValueError('{} ended before its charge density'.format(f.name))
+
+
+def chgcar_header(structure):
+    # Structure at the top of a CHGCAR: a POSCAR without selective dynamics, velocities or other site properties
+    from pymatgen.io.vasp.inputs import Poscar
+    structure = structure.copy()
+    for key in list(structure.site_properties):
+        structure.remove_site_property(key)
+    return Poscar(structure).get_string() + '\n'
+
+
+def interpolate_chgcar(start, final, fractions, outputs, structures=None, chunk=20000):
+    """
+    Linearly interpolate the CHGCARs start and final (same atoms and FFT grid) into one CHGCAR per fraction, for
+    ICHARG=1 starts.  Both files are read once, line by line, and only chunk lines of each are held in memory.  Lines
+    that are the same in both (grid sizes, augmentation headers, ...) are copied, numbers that differ are interpolated.
+
+    :param start: CHGCAR at fraction 0
+    :param final: CHGCAR at fraction 1
+    :param fractions: where each output lies between start and final
+    :param outputs: files to write, one per fraction
+    :param structures: Structure of each output for its header, site properties left out (Default: header of start)
+    :param chunk: number of lines interpolated at once
+    :return: outputs
+    """
+    fractions = np.asarray(fractions, dtype=float)
+    with open(start) as f_1, open(final) as f_2:
+        header = read_chgcar_header(f_1)
+        read_chgcar_header(f_2)
+        grid_1, grid_2 = f_1.readline(), f_2.readline()
+        if grid_1.split() != grid_2.split():
+            raise ValueError('{} and {} have different FFT grids: {} and {}'.format(start, final, grid_1.split(),
+                                                                                   grid_2.split()))
+        files = [open(output, 'w') for output in outputs]
+        try:
+            for i, f in enumerate(files):
+                if structures is None:
+                    f.writelines(header)
+                else:
+                    f.write(chgcar_header(structures[i]))
+                f.write(grid_1)
+
+            block_1, block_2 = [], []
+
+            def flush():
+                if not block_1:
+                    return
+                values_1 = np.array(' '.join(block_1).split(), dtype=float)
+                values_2 = np.array(' '.join(block_2).split(), dtype=float)
+                if len(values_1) != len(values_2):
+                    raise ValueError('{} and {} do not line up'.format(start, final))
+                counts = [len(line.split()) for line in block_1]
+                for fraction, f in zip(fractions, files):
+                    values = values_1 + fraction * (values_2 - values_1)
+                    lines, n = [], 0
+                    for count in counts:
+                        lines.append((' %17.11E' * count + '\n') % tuple(values[n:n + count]))
+                        n += count
+                    f.writelines(lines)
+                del block_1[:], block_2[:]
+
+            for line_1, line_2 in zip(f_1, f_2):
+                if line_1 == line_2 or not line_1.split() or not line_1.split()[0][-1].isdigit():
+                    flush()
+                    for f in files:
+                        f.write(line_1)
+                    continue
+                block_1.append(line_1)
+                block_2.append(line_2)
+                if len(block_1) >= chunk:
+                    flush()
+            flush()
+            if f_1.readline() or f_2.readline():
+                raise ValueError('{} and {} have different lengths'.format(start, final))
+        finally:
+            for f in files:
+                f.close()
+    return outputs
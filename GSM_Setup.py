@@ -2,7 +2,10 @@
 
 import os
 import sys
+import itertools
+import numpy as np
 import Helpers
+from FileTools import seed_file
 import shutil
 import jinja2
 import ase.io
@@ -160,53 +163,15 @@ def GSM_Setup(start, final=None, new_gsm_dir='.', images=None, center=[0.5,0.5,0
     os.chmod('grad.py', 0o755)
     os.chmod('status', 0o755)
     poscar = Poscar.from_file('POSCAR.start', check_for_POTCAR=False)
-    if poscar.selective_dynamics:
-        sd = poscar.selective_dynamics
-    else:
-        sd = [(True, True, True)] * poscar.natoms
-
-    ase.io.write('scratch/initial0000.temp.xyz', initial, )
+    path = NEBPath(np.array(start.get_cell()), start.get_chemical_symbols(), [atoms.positions for atoms in initial],
+                   poscar.selective_dynamics)
     if fix_positions and final:
-        with open('scratch/initial0000.temp.xyz', 'r') as f:
-            lines = [ x.split() for x in f.readlines() ]
-            cell = start.get_cell()
-            sfp = final.get_scaled_positions() # Scaled Final Positions
-            # ssp = start.get_scaled_positions() # Scaled Final Positions
-            start_i = 2
-            final_i = 2*start_i + len(sfp)
-            for i, pos in enumerate(sfp):
-                start_coord = np.matrix([ np.float128(x) for x in lines[start_i + i][1:4] ])
-                final_coord = np.matrix([ np.float128(x) for x in lines[final_i + i][1:4] ])
-                final_coord_temp = final_coord
-                distance = np.linalg.norm(start_coord - final_coord)
-                for x in [-1, 0 , 1]:
-                    for y in [-1, 0, 1]:
-                        for z in [-1, 0, 1]:
-                            final_coord_diff = np.matrix([x,y,z]) * cell
-                            distance_temp = np.linalg.norm(start_coord - (final_coord+final_coord_diff))
-                            if distance_temp < distance:
-                                final_coord_temp = final_coord+final_coord_diff
-                                distance = distance_temp
-                lines[final_i+i][1] = final_coord_temp[0,0]
-                lines[final_i+i][2] = final_coord_temp[0,1]
-                lines[final_i+i][3] = final_coord_temp[0,2]
-
-        with open('scratch/initial0000.temp.xyz', 'w') as f:
-            lines = [' '.join([ str(x) for x in line ]) for line in lines]
-            f.write( '\n'.join(lines) )
-
-
-
-    with open('scratch/initial0000.temp.xyz', 'r') as f:
-        # Convert True SD to frozen atoms
-        sd = list(map(lambda l : '\n' if (l[0] or l[1] or l[2]) else ' "X"\n', sd))
-        # Set up sd to be zipped (two buffer lines at top of each structure)
-        to_zip = (['\n', '\n'] + sd) * len(initial)
-        zipped = zip(f.readlines(), to_zip)
-        xyz = [ ' '.join(x.split()[0:4])+y for x, y in zipped ] # Remove atom number
-        with open('scratch/initial0000.xyz', 'w') as f:
-            f.writelines(xyz)
-        os.remove('scratch/initial0000.temp.xyz')
+        # Move each atom of final to its periodic image closest to start
+        shifts = np.dot(list(itertools.product([-1, 0, 1], repeat=3)), path.lattice.matrix)
+        candidates = path.coords[-1][:, np.newaxis, :] + shifts
+        distances = np.linalg.norm(candidates - path.coords[0][:, np.newaxis, :], axis=2)
+        path.coords[-1] = candidates[np.arange(path.natoms), np.argmin(distances, axis=1)]
+    path.write_xyz('scratch/initial0000.xyz', mark_frozen=True)
 
 
     if copy_wavefunction:
@@ -214,14 +179,14 @@ def GSM_Setup(start, final=None, new_gsm_dir='.', images=None, center=[0.5,0.5,0
             print('Copying initial WAVECAR')
             if not os.path.exists(os.path.join(new_gsm_dir, 'scratch/IMAGE.01')):
                 os.makedirs(os.path.join(new_gsm_dir, 'scratch/IMAGE.01'))
-            shutil.copy(os.path.join(start_folder, 'WAVECAR'),
-                        os.path.join(new_gsm_dir, 'scratch/IMAGE.01/WAVECAR'))
+            seed_file(os.path.join(start_folder, 'WAVECAR'),
+                      os.path.join(new_gsm_dir, 'scratch/IMAGE.01/WAVECAR'))
         if os.path.exists(os.path.join(start_folder, 'CHGCAR')):
             print('Copying initial CHGCAR')
             if not os.path.exists(os.path.join(new_gsm_dir, 'scratch/IMAGE.01')):
                 os.makedirs(os.path.join(new_gsm_dir, 'scratch/IMAGE.01'))
-            shutil.copy(os.path.join(start_folder, 'CHGCAR'),
-                        os.path.join(new_gsm_dir, 'scratch/IMAGE.01/CHGCAR'))
+            seed_file(os.path.join(start_folder, 'CHGCAR'),
+                      os.path.join(new_gsm_dir, 'scratch/IMAGE.01/CHGCAR'))
 
 
         if final: # is GSM
@@ -230,14 +195,14 @@ def GSM_Setup(start, final=None, new_gsm_dir='.', images=None, center=[0.5,0.5,0
                 print('Copying final WAVECAR')
                 if not os.path.exists(os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2))):
                     os.makedirs(os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2)))
-                shutil.copy(os.path.join(final_folder, 'WAVECAR'),
-                            os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2) + '/WAVECAR'))
+                seed_file(os.path.join(final_folder, 'WAVECAR'),
+                          os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2) + '/WAVECAR'))
             if os.path.exists(os.path.join(final_folder, 'CHGCAR')):
                 print('Copying final CHGCAR')
                 if not os.path.exists(os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2))):
                     os.makedirs(os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2)))
-                shutil.copy(os.path.join(final_folder, 'CHGCAR'),
-                            os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2) + '/CHGCAR'))
+                seed_file(os.path.join(final_folder, 'CHGCAR'),
+                          os.path.join(new_gsm_dir, 'scratch/IMAGE.' + str(images).zfill(2) + '/CHGCAR'))
 
     os.chdir(currdir)
 
@@ -2,7 +2,6 @@
 # Not meant to be called from command line
 
 import os
-import subprocess
 from pymatgen.core.structure import *
 from pymatgen.core import PeriodicSite
 from pymatgen.analysis.transition_state import NEBAnalysis
@@ -10,10 +9,11 @@ import cfg
 import socket
 import shutil
 from Classes_Pymatgen import *
+from OutcarScanner import scan_outcar
 from functools import reduce
-import tempfile
 import numpy as np
 from math import ceil
+from itertools import product
 
 # def pmg_to_ase(pmg_structure : Structure):
 #     from ase.io import read
@@ -47,93 +47,141 @@ def get_FERE_chemical_potential(element):
 
 
 def pmg_to_pyl_poscar(poscar : Poscar):
-    from pylada.crystal import read, write
-    import pylada.crystal
-    with tempfile.NamedTemporaryFile() as f:
-        poscar.write_file(f.name)
-        pyl = read.poscar(f.name)
-    return pyl
+    # Selective dynamics become pylada's freeze attribute, as read.poscar would set it
+    return pmg_to_pyl(poscar.structure)
+
+def selective_dynamics_to_freeze(selective_dynamics):
+    # pylada keeps the directions an atom can not move in as a string, e.g. 'xz'
+    return ''.join(axis for axis, move in zip('xyz', selective_dynamics) if not move)
+
+def freeze_to_selective_dynamics(freeze):
+    return [axis not in freeze for axis in 'xyz']
 
 def pmg_to_pyl(pmg : Structure):
+    """
+    :param pmg: pymatgen Structure
+    :return: pylada Structure with the same cell, cartesian positions, species and site properties (as atom attributes,
+        selective_dynamics as freeze)
+    """
     from pylada.crystal import Structure as Pyl_Structure
     from pylada.crystal import Atom
     pyl = Pyl_Structure(np.transpose(pmg.lattice.matrix))
-    for i in range(len(pmg)):
-        if pmg.site_properties:
-            kwargs = {x: pmg.site_properties[x][i] for x in pmg.site_properties}
-        else:
-            kwargs = {}
-        coords = pmg[i].coords
-        specie = str(pmg[i].specie)
-        pyl_atom = Atom(coords[0], coords[1], coords[2], specie, **kwargs)
-        pyl.add_atom(pyl_atom)
+    properties = dict(pmg.site_properties)
+    if 'selective_dynamics' in properties:
+        properties['freeze'] = [selective_dynamics_to_freeze(x) for x in properties.pop('selective_dynamics')]
+    tags = list(properties)
+    rows = zip(*[properties[tag] for tag in tags]) if tags else [()] * len(pmg)
+    species = [site.species_string for site in pmg]
+    for coords, specie, row in zip(pmg.cart_coords.tolist(), species, rows):
+        pyl.add_atom(Atom(coords[0], coords[1], coords[2], specie, **dict(zip(tags, row))))
     return pyl
 
 def pyl_to_pmg(structure):
-    redundant_properties = ['pos', 'type']
+    """
+    :param structure: pylada Structure
+    :return: pymatgen Structure with the attributes shared by every atom (besides pos and type) as site properties,
+        freeze as selective_dynamics
+    """
     pyl_dict = structure.to_dict()
-    property_tags = [x for x in pyl_dict[0] if x not in redundant_properties]
-    pmg_dict = {}
-    for tag in property_tags:
-        pmg_dict[tag] = [pyl_dict[site][tag] for site in range(len(structure))]
-    coords = [ atom.pos for atom in structure ]
-    species = [atom.type for atom in structure]
-    return Structure(np.transpose(structure.cell), species, coords, coords_are_cartesian=True, site_properties=pmg_dict)
+    atoms = [pyl_dict[site] for site in range(len(structure))]
+    if not atoms:
+        return Structure(np.transpose(structure.cell), [], [])
+    coords = np.array([atom['pos'] for atom in atoms], dtype=float)
+    species = [atom['type'] for atom in atoms]
+    tags = set(atoms[0]).intersection(*atoms[1:]) - {'pos', 'type', 'freeze'}
+    site_properties = {tag: [atom[tag] for atom in atoms] for tag in sorted(tags)}
+    if any(atom.get('freeze') for atom in atoms):
+        site_properties['selective_dynamics'] = [freeze_to_selective_dynamics(atom.get('freeze', '')) for atom in atoms]
+    return Structure(np.transpose(structure.cell), species, coords, coords_are_cartesian=True,
+                     site_properties=site_properties)
+
+def get_supercells_without(short, n):
+    """
+    Supercell matrices of determinant n in Hermite normal form (lower triangular, so every distinct supercell is found
+    exactly once) that contain none of the vectors in short.  Rows are checked one at a time so most matrices are
+    never built.
+
+    :param short: np.array (n_vectors, 3) of int, coordinates in the cell being expanded
+    :param n: number of cells in the supercell
+    :return: list of (3, 3) np.arrays of int
+    """
+    (k0, k1, k2) = short.T
+    matrices = []
+    for a in [a for a in range(1, n + 1) if n % a == 0]:
+        if ((k1 == 0) & (k2 == 0) & (k0 % a == 0)).any():
+            continue
+        in_plane = short[k2 == 0]
+        for c in [c for c in range(1, n // a + 1) if (n // a) % c == 0]:
+            f = n // a // c
+            out_of_plane = short[(k2 != 0) & (k2 % f == 0)]
+            t = out_of_plane[:, 2] // f
+            # Rows are reduced against the rows above them: 0 <= b < a, 0 <= d < a and 0 <= e < c
+            (d, e) = [x.ravel() for x in np.meshgrid(np.arange(a), np.arange(c), indexing='ij')]
+            for b in range(a):
+                # Vector k is in the lattice of rows (a, 0, 0), (b, c, 0), (d, e, f) if back substitution stays integral
+                u = in_plane[:, 1] // c
+                if ((in_plane[:, 1] % c == 0) & ((in_plane[:, 0] - b * u) % a == 0)).any():
+                    continue
+                r1 = out_of_plane[:, 1] - np.outer(e, t)
+                u = r1 // c
+                contained = (r1 % c == 0) & ((out_of_plane[:, 0] - np.outer(d, t) - b * u) % a == 0)
+                for i in np.where(~contained.any(axis=1))[0]:
+                    matrices.append(np.array([[a, 0, 0], [b, c, 0], [d[i], e[i], f]]))
+    return matrices
+
+def get_short_vectors(matrix, length):
+    """
+    Integer coordinates of every lattice vector shorter than length (one of each +- pair)
+
+    :param matrix: (3, 3) lattice vectors as rows
+    :param length: Angstrom
+    :return: np.array (n_vectors, 3) of int
+    """
+    bounds = np.floor(length * np.linalg.norm(np.linalg.inv(matrix), axis=0)).astype(int)
+    grid = np.array(list(product(*[range(-b, b + 1) for b in bounds])), dtype=np.int64)
+    grid = grid[(grid[:, 0] > 0) | ((grid[:, 0] == 0) & ((grid[:, 1] > 0) | ((grid[:, 1] == 0) & (grid[:, 2] > 0))))]
+    return grid[np.linalg.norm(np.dot(grid, matrix), axis=1) < length]
 
 def get_smallest_expansion(structure : Structure, length : float):
     """
-    Finds the smallest expansion of the provided cell such that all sides are at minimum length.  Will change shape of
-    cell if it creates a better match
+    Finds the smallest supercell of the provided cell (any integer matrix, not only diagonal expansions) in which no
+    atom is within length of its own periodic image, so all sides of the reduced cell are at minimum length.
+    Candidates are scored from the lattice alone; only the best one is built, as an LLL reduced cell.
     :param structure: Unit cell to convert
     :param length: Minimum vector difference
     :return:
     """
-    from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-    sga = SpacegroupAnalyzer(structure)
-    structures = []
-    structures.append(structure)
     try:
-        structures.append(structure.get_primitive_structure())
+        primitive = structure.get_primitive_structure()
     except:
-        pass
-    try:
-        structures.append(structure.get_reduced_structure('niggli'))
-    except:
-        pass
-    try:
-        structures.append(structure.get_reduced_structure('LLL'))
-    except:
-        pass
-    try:
-        structures.append(sga.get_conventional_standard_structure())
-    except:
-        pass
-    try:
-        structures.append(sga.get_primitive_standard_structure())
-    except:
-        pass
+        primitive = structure
+    matrix = primitive.lattice.matrix
+    short = get_short_vectors(matrix, length)
+    # A lattice with no vector shorter than length has at least the volume of fcc with that spacing
+    n = max(1, int(ceil(length ** 3 / np.sqrt(2) / primitive.volume - 1e-8)))
+    best = None
+    while best is None:
+        for hnf in get_supercells_without(short, n):
+            lattice = Lattice(np.dot(hnf, matrix)).get_lll_reduced_lattice()
+            angle = min(min(a, 180 - a) for a in lattice.angles)
+            score = (round(min(lattice.abc), 3), angle)
+            if best is None or score > best[0]:
+                best = (score, hnf)
+        n += 1
+    best_structure = (primitive * best[1]).get_reduced_structure('LLL')
 
-    best_structure = None
-    for s in structures: # type: Structure
-        l = s.lattice
-        expansion = [ ceil(length / vec) for vec in l.abc ]
-        possible_structure = s * expansion
-        if best_structure == None or \
-                (min(best_structure.lattice.angles) < 40 and min(possible_structure.lattice.angles) > min(best_structure.lattice.angles)) or \
-                len(possible_structure) < len(best_structure):
-            best_structure = possible_structure
     if structure.site_properties and not best_structure.site_properties:
-        def get_property(prop, atom):
-            i = structure.species.index(atom)
-            return structure.site_properties[prop][i]
-        site_properties = { prop : [ get_property(prop, atom) for atom in best_structure.species ] for prop in structure.site_properties}
+        first_i = {}
+        for i, atom in enumerate(structure.species):
+            first_i.setdefault(atom, i)
+        indices = np.array([first_i[atom] for atom in best_structure.species], dtype=int)
+        site_properties = { prop : np.array(values, dtype=object)[indices].tolist()
+                            for prop, values in structure.site_properties.items() }
         best_structure = Structure(best_structure.lattice, best_structure.species, best_structure.frac_coords, site_properties=site_properties)
     return best_structure
 
 def get_nelect(outcar):
-    line = subprocess.check_output(['grep', 'NELECT', outcar])
-    nelect = int(line.split()[2].split('.')[0])
-    return nelect
+    return int(scan_outcar(outcar).nelect)
 
 
 def xfrange(start, stop, step):
@@ -170,18 +218,72 @@ def neb2dim(neb_dir, dimer_dir):
     os.remove(os.path.join(dimer_dir, 'INCAR'))
     incar.write_file('INCAR')
 
+def get_min_image_displacements(frac_diff, lattice):
+    """
+    Shortest cartesian vectors equivalent to fractional displacements under periodic boundary conditions
+
+    :param frac_diff: (..., 3) fractional displacements
+    :param lattice: (3, 3) lattice vectors as rows
+    :return: (..., 3) cartesian displacements
+    """
+    frac_diff = np.asarray(frac_diff) - np.round(frac_diff)
+    shifts = np.array([[x, y, z] for x in [-1, 0, 1] for y in [-1, 0, 1] for z in [-1, 0, 1]])
+    candidates = np.dot(frac_diff[..., np.newaxis, :] + shifts, lattice)  # (..., 27, 3), exact for skewed cells
+    best = np.argmin((candidates ** 2).sum(-1), axis=-1)
+    return np.take_along_axis(candidates, best[..., np.newaxis, np.newaxis], axis=-2)[..., 0, :]
+
+def get_image_distance(structure_1, structure_2):
+    """
+    Distance between two images with the same atoms in the same order, in the lattice of structure_1
+
+    :return: dict with total (norm of all displacements), rms and max displacement (Angstrom) and max_atom (index)
+    """
+    displacements = np.linalg.norm(get_min_image_displacements(structure_2.frac_coords - structure_1.frac_coords,
+                                                               structure_1.lattice.matrix), axis=-1)
+    return {'total': float(np.sqrt((displacements ** 2).sum())), 'rms': float(np.sqrt((displacements ** 2).mean())),
+            'max': float(displacements.max()), 'max_atom': int(np.argmax(displacements))}
+
 def getImageDistance(POSCAR_1, POSCAR_2):
-    full_distance_string = subprocess.check_output(os.path.join(os.environ['VTST_DIR'],'diffcon.pl')+ ' '+ POSCAR_1 +' ' +POSCAR_2, shell=True)
-    distance = full_distance_string.split('\n')[-4].split(' ')[-1] # Stripping rest of the file away
-    return distance
+    """
+    Total distance between two POSCARs (what diffcon.pl reports), without calling VTST
 
-def getJobType(dir):
-    if os.path.basename(dir) == 'INCAR':
-        incar = Incar.from_file(dir)
-    else:
-        incar = Incar.from_file(os.path.join(dir,'INCAR'))
-    if os.path.exists(os.path.join(dir, 'inpfileq')):
-        with open('inpfileq') as inpfileq:
+    :return: float (Angstrom)
+    """
+    return get_image_distance(Poscar.from_file(POSCAR_1, check_for_POTCAR=False).structure,
+                              Poscar.from_file(POSCAR_2, check_for_POTCAR=False).structure)['total']
+
+def get_neb_distances(neb_dir, check_CONTCAR=False):
+    """
+    Distances between every pair of consecutive images of an NEB, in one pass over the whole path
+
+    :param neb_dir: NEB directory with numbered image folders
+    :param check_CONTCAR: use CONTCARs where they exist
+    :return: dict of np.arrays (one entry per pair of images) with keys total, rms, max and max_atom
+    """
+    path = NEBPath.from_directory(neb_dir, check_CONTCAR)
+    frac_coords = path.frac_coords
+    displacements = np.linalg.norm(get_min_image_displacements(frac_coords[1:] - frac_coords[:-1],
+                                                               path.lattice.matrix), axis=-1)
+    return {'total': np.sqrt((displacements ** 2).sum(-1)), 'rms': np.sqrt((displacements ** 2).mean(-1)),
+            'max': displacements.max(-1), 'max_atom': np.argmax(displacements, axis=-1)}
+
+job_types = {}  # folder -> (stat of INCAR and inpfileq, job type), see getJobType
+
+def get_input_stats(folder):
+    # (mtime, size) of INCAR and inpfileq in folder, None for missing files
+    stats = []
+    for name in ['INCAR', 'inpfileq']:
+        try:
+            stat = os.stat(os.path.join(folder, name))
+            stats.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stats.append(None)
+    return tuple(stats)
+
+def classify_job(folder):
+    # Job type from INCAR and inpfileq, without caching
+    if os.path.exists(os.path.join(folder, 'inpfileq')):
+        with open(os.path.join(folder, 'inpfileq')) as inpfileq:
             for line in inpfileq.readlines():
                 if len(line.split()) > 1 and 'SM_TYPE' in line.split()[0]:
                     if 'SSM' in line.split()[1]:
@@ -191,7 +293,8 @@ def getJobType(dir):
                     else:
                         raise Exception('Problem with following line in inpfileq:  \n' + line + '\n Expected following format: SM_TYPE   SSM/GSM')
         return 'GSM'
-    elif 'ICHAIN' in incar:
+    incar = Incar.from_file(os.path.join(folder, 'INCAR'))
+    if 'ICHAIN' in incar:
         if incar['ICHAIN'] == 0:
             return 'NEB'
         elif incar['ICHAIN'] == 1:
@@ -205,6 +308,54 @@ def getJobType(dir):
     else:
         return 'Standard'
 
+def getJobType(dir):
+    """
+    Job type of a VASP run: SSM, GSM, NEB, DynMat, Dimer or Standard.  Results are cached until INCAR or inpfileq
+    changes.
+
+    :param dir: run folder or its INCAR
+    :return: job type
+    """
+    folder = os.path.dirname(dir) if os.path.basename(dir) == 'INCAR' else dir
+    folder = os.path.abspath(folder)
+    stats = get_input_stats(folder)
+    if folder in job_types and job_types[folder][0] == stats:
+        return job_types[folder][1]
+    if stats[0] is None and stats[1] is None:
+        raise FileNotFoundError('No INCAR in ' + folder)
+    job_type = classify_job(folder)
+    job_types[folder] = (stats, job_type)
+    return job_type
+
+def get_job_types(root='.', follow_symlinks=False):
+    """
+    getJobType of every folder under root (including root) with an INCAR or inpfileq
+
+    :param root: top folder
+    :param follow_symlinks: also descend into symlinked folders
+    :return: dict of folder -> job type (None if the inputs could not be classified)
+    """
+    results = {}
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        has_input = False
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.name in ('INCAR', 'inpfileq') and entry.is_file():
+                        has_input = True
+                    elif entry.is_dir(follow_symlinks=follow_symlinks):
+                        folders.append(entry.path)
+        except OSError:
+            continue
+        if has_input:
+            try:
+                results[folder] = getJobType(folder)
+            except Exception:
+                results[folder] = None
+    return results
+
 def getComputerName():
     if 'VASP_COMPUTER' in os.environ:
         return os.environ['VASP_COMPUTER']
@@ -220,9 +371,7 @@ def getComputerName():
         raise Exception('On an unrecognized computer')
 
 def getLoopPlusTimes(outcar):
-    grep = subprocess.check_output('grep LOOP+: ' + outcar, shell=True).strip().split('\n')
-    times = map(lambda l: float(l.split()[-1]), grep)
-    return times
+    return scan_outcar(outcar).loop_plus_times
 
 def getMaxLoopTimes(times):
     return sum(map(lambda x: max(x),
@@ -263,29 +412,37 @@ def isint(string):
         return False
 
 def get_corresponding_atom_i(structure1, structure2, init_distance=0.5, same_atom=True):
-    corresponding_atom_i = []
-    if len(structure1) < len(structure2):
-        smaller_structure = structure1
-        larger_structure = structure2
-        swap = False
-    else:
-        smaller_structure = structure2
-        larger_structure = structure1
-        swap = True
-    for i in range(len(smaller_structure)):
-        a1 = smaller_structure[i]
-        j_least = None
-        least_distance = 9999999
-        for j in range(len(larger_structure)):
-            a2 = larger_structure[j]
-            distance = a1.distance(a2)
-            if distance < least_distance:
-                least_distance = distance
-                j_least = j
-        corresponding_atom_i.append( (i, j_least))
+    """
+    Nearest atom of the larger structure (periodic minimum image) to every atom of the smaller one
+
+    init_distance and same_atom used to be ignored and every atom was matched; they are now applied, so by default
+    pairs more than 0.5 A apart or of different species are left out.  Pass init_distance=None, same_atom=False for
+    the old matching.  The result used to be a list of (i, j) tuples; it is now three arrays, use zip(i1, i2) for the
+    old pairs.
+
+    :param structure1: Structure
+    :param structure2: Structure
+    :param init_distance: drop pairs further apart than this (Angstrom), None to keep every pair
+    :param same_atom: only match atoms of the same species
+    :return: (indices in structure1, indices in structure2, distances) as np.arrays, one entry per matched atom
+    """
+    swap = len(structure1) >= len(structure2)
+    (smaller_structure, larger_structure) = (structure2, structure1) if swap else (structure1, structure2)
+    distances = smaller_structure.lattice.get_all_distances(smaller_structure.frac_coords, larger_structure.frac_coords)
+    if same_atom:
+        species_small = np.array([site.species_string for site in smaller_structure])
+        species_large = np.array([site.species_string for site in larger_structure])
+        distances[species_small[:, np.newaxis] != species_large[np.newaxis, :]] = np.inf
+    i_small = np.arange(len(smaller_structure))
+    i_large = np.argmin(distances, axis=1) if len(larger_structure) else np.zeros(0, dtype=int)
+    least_distance = distances[i_small, i_large]
+    keep = np.isfinite(least_distance)
+    if init_distance is not None:
+        keep &= least_distance <= init_distance
+    (i_small, i_large, least_distance) = (i_small[keep], i_large[keep], least_distance[keep])
     if swap:
-        corresponding_atom_i = [(j,i) for i,j in corresponding_atom_i]
-    return corresponding_atom_i
+        return i_large, i_small, least_distance
+    return i_small, i_large, least_distance
 
 fere_orbitals = {
 #2s
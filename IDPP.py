@@ -0,0 +1,199 @@
+# Image dependent pair potential (IDPP) interpolation of NEB paths on plain numpy arrays
+# Smidstrup, Pedersen, Stokbro and Jonsson, J. Chem. Phys. 140, 214106 (2014)
+# Not meant to be called from command line
+
+import numpy as np
+from pymatgen.core import Structure
+
+
+def get_pair_vectors(coords, lattice=None):
+    """
+    Minimum image vectors between every pair of atoms
+
+    :param coords: (..., n_atoms, 3) cartesian coordinates
+    :param lattice: (3, 3) lattice vectors as rows (None for no periodicity)
+    :return: (D, d) where D[..., i, j] = coords[..., j] - coords[..., i] and d is its length
+    """
+    D = coords[..., np.newaxis, :, :] - coords[..., :, np.newaxis, :]
+    if lattice is not None:
+        frac = np.dot(D, np.linalg.inv(lattice))
+        D = np.dot(frac - np.round(frac), lattice)
+    return D, np.sqrt((D ** 2).sum(-1))
+
+
+def get_idpp_forces(coords, targets, lattice=None):
+    """
+    IDPP energy and forces of each image
+
+    :param coords: (n_images, n_atoms, 3) cartesian coordinates
+    :param targets: (n_images, n_atoms, n_atoms) target pair distances
+    :param lattice: (3, 3) lattice vectors as rows (None for no periodicity)
+    :return: (energies, forces) with shapes (n_images,) and (n_images, n_atoms, 3)
+    """
+    D, d = get_pair_vectors(coords, lattice)
+    diagonal = np.eye(coords.shape[-2], dtype=bool)
+    d[..., diagonal] = 1  # avoid dividing by zero, D is zero on the diagonal
+    dd = d - targets
+    dd[..., diagonal] = 0
+    energies = 0.5 * (dd ** 2 / d ** 4).sum((-1, -2))
+    forces = ((2 * dd * (2 * targets - d) / d ** 6)[..., np.newaxis] * D).sum(-2)
+    return energies, forces
+
+
+def get_targets(start, final, n, lattice=None):
+    """
+    Pair distances linearly interpolated between start and final
+
+    :param start: (n_atoms, 3) cartesian coordinates
+    :param final: (n_atoms, 3) cartesian coordinates
+    :param n: fractions along the path, (n_images,)
+    :param lattice: (3, 3) lattice vectors as rows (None for no periodicity)
+    :return: (n_images, n_atoms, n_atoms)
+    """
+    d_start = get_pair_vectors(start, lattice)[1]
+    d_final = get_pair_vectors(final, lattice)[1]
+    n = np.asarray(n, dtype=float)[:, np.newaxis, np.newaxis]
+    return d_start + n * (d_final - d_start)
+
+
+def relax(coords, get_forces, fmax=0.1, steps=100, dt=0.2, maxstep=0.2):
+    """
+    MDMin relaxation of all images at once (same scheme as ASE's MDMin, which ASE uses for IDPP)
+
+    :param coords: (n_images, n_atoms, 3) starting coordinates, not modified
+    :param get_forces: function of coords returning forces of the same shape
+    :param fmax: converged when no atom has a larger force (eV/A)
+    :param steps: maximum number of steps
+    :param dt: time step
+    :param maxstep: largest distance any atom moves in one step (A)
+    :return: (n_images, n_atoms, 3) relaxed coordinates
+    """
+    coords = coords.copy()
+    v = np.zeros_like(coords)
+    for _ in range(steps):
+        f = get_forces(coords)
+        if np.sqrt((f ** 2).sum(-1)).max() < fmax:
+            break
+        v += 0.5 * dt * f
+        vf = np.vdot(f, v)
+        v = f * vf / np.vdot(f, f) if vf > 0 else np.zeros_like(v)
+        v += 0.5 * dt * f
+        dr = dt * v
+        step = np.sqrt((dr ** 2).sum(-1)).max()
+        if step > maxstep:
+            dr *= maxstep / step
+        coords += dr
+    return coords
+
+
+def idpp_interpolate(start, final, nimages, lattice=None, mask=None, k=0.1, fmax=0.1, steps=100):
+    """
+    IDPP path between start and final as an NEB with nimages intervals.  Pair distances use the minimum image
+    convention when lattice is given.
+
+    :param start: (n_atoms, 3) cartesian coordinates
+    :param final: (n_atoms, 3) cartesian coordinates, same image of every atom as the path should take
+    :param nimages: number of intervals, so nimages+1 images are returned
+    :param lattice: (3, 3) lattice vectors as rows (None for no periodicity)
+    :param mask: (n_atoms, 3) 1 for coordinates that may move, 0 for fixed (selective dynamics)
+    :param k: spring constant between images
+    :param fmax: convergence criteria (eV/A)
+    :param steps: maximum number of relaxation steps
+    :return: (nimages+1, n_atoms, 3) coordinates
+    """
+    start = np.asarray(start, dtype=float)
+    final = np.asarray(final, dtype=float)
+    n = np.linspace(0, 1, nimages + 1)
+    path = start + n[:, np.newaxis, np.newaxis] * (final - start)
+    if nimages < 2:
+        return path
+    targets = get_targets(start, final, n[1:-1], lattice)
+
+    def get_forces(interior):
+        images = np.concatenate([start[np.newaxis], interior, final[np.newaxis]])
+        f = get_idpp_forces(interior, targets, lattice)[1]
+        tangent = images[2:] - images[:-2]
+        tangent /= np.sqrt((tangent ** 2).sum((-1, -2)))[:, np.newaxis, np.newaxis]
+        f_perp = f - (f * tangent).sum((-1, -2))[:, np.newaxis, np.newaxis] * tangent
+        spacing = np.sqrt(((images[1:] - images[:-1]) ** 2).sum((-1, -2)))
+        f = f_perp + (k * (spacing[1:] - spacing[:-1]))[:, np.newaxis, np.newaxis] * tangent
+        return f if mask is None else f * mask
+
+    path[1:-1] = relax(path[1:-1], get_forces, fmax, steps)
+    return path
+
+
+def idpp_image(start, final, fraction=0.5, lattice=None, mask=None, fmax=0.1, steps=100):
+    """
+    Single image of the IDPP path, without building the rest of it.  The image stays at fraction along the line from
+    start to final and only relaxes perpendicular to it.
+
+    :param start: (n_atoms, 3) cartesian coordinates
+    :param final: (n_atoms, 3) cartesian coordinates, same image of every atom as the path should take
+    :param fraction: where along the path (0 to 1)
+    :param lattice: (3, 3) lattice vectors as rows (None for no periodicity)
+    :param mask: (n_atoms, 3) 1 for coordinates that may move, 0 for fixed (selective dynamics)
+    :param fmax: convergence criteria (eV/A)
+    :param steps: maximum number of relaxation steps
+    :return: (n_atoms, 3) coordinates
+    """
+    start = np.asarray(start, dtype=float)
+    final = np.asarray(final, dtype=float)
+    image = start + fraction * (final - start)
+    if fraction <= 0 or fraction >= 1:
+        return image
+    targets = get_targets(start, final, [fraction], lattice)
+    tangent = final - start
+    tangent /= np.sqrt((tangent ** 2).sum()) or 1
+
+    def get_forces(coords):
+        f = get_idpp_forces(coords, targets, lattice)[1]
+        f -= (f * tangent).sum() * tangent
+        return f if mask is None else f * mask
+
+    return relax(image[np.newaxis], get_forces, fmax, steps)[0]
+
+
+def get_mask(structure: Structure):
+    # selective dynamics of structure as an IDPP mask, None if all atoms are free
+    if 'selective_dynamics' not in structure.site_properties:
+        return None
+    return np.array(structure.site_properties['selective_dynamics'], dtype=float)
+
+
+def get_coords(start: Structure, final: Structure):
+    # Cartesian coordinates of start and of the image of each site of final nearest to it, in start's lattice
+    diff = final.frac_coords - start.frac_coords
+    return start.cart_coords, start.lattice.get_cartesian_coords(start.frac_coords + diff - np.round(diff))
+
+
+def idpp_structures(start: Structure, final: Structure, nimages, **kwargs):
+    """
+    idpp_interpolate on Structures with matching site order
+
+    :param start: Structure
+    :param final: Structure
+    :param nimages: number of intervals, so nimages+1 structures are returned
+    :param kwargs: passed to idpp_interpolate
+    :return: list of Structures
+    """
+    kwargs.setdefault('mask', get_mask(start))
+    path = idpp_interpolate(*get_coords(start, final), nimages, lattice=start.lattice.matrix, **kwargs)
+    return [Structure(start.lattice, start.species, coords, coords_are_cartesian=True,
+                      site_properties=start.site_properties) for coords in path]
+
+
+def idpp_structure(start: Structure, final: Structure, fraction=0.5, **kwargs):
+    """
+    idpp_image on Structures with matching site order
+
+    :param start: Structure
+    :param final: Structure
+    :param fraction: where along the path (0 to 1)
+    :param kwargs: passed to idpp_image
+    :return: Structure
+    """
+    kwargs.setdefault('mask', get_mask(start))
+    coords = idpp_image(*get_coords(start, final), fraction, lattice=start.lattice.matrix, **kwargs)
+    return Structure(start.lattice, start.species, coords, coords_are_cartesian=True,
+                     site_properties=start.site_properties)
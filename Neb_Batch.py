@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Builds many NEBs with nebmake in a process pool.  Each line of the manifest is one NEB:
+#   initial final directory [images [tolerance [atom_pairs ...]]]
+# blank lines and anything after # are ignored.  images and tolerance default to the command line values.
+
+# usage:  Neb_Batch.py manifest [-p processes] [-i images] [-t tolerance] [--templates folder] [--assign]
+import argparse
+import os
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from Classes_Pymatgen import Incar, Kpoints, Potcar
+from Neb_Make import nebmake
+from Helpers import get_image_distance
+
+templates = None  # (Incar, Kpoints, Potcar) shared by every NEB of a worker
+
+
+def read_manifest(manifest, images=7, tolerance=0):
+    """
+    :param manifest: path of the manifest
+    :param images: default number of images
+    :param tolerance: default tolerance
+    :return: list of dicts with keys initial, final, directory, images, tolerance, atom_pairs
+    """
+    nebs = []
+    with open(manifest) as f:
+        for n, line in enumerate(f):
+            line = line.split('#')[0].split()
+            if not line:
+                continue
+            if len(line) < 3:
+                raise Exception('Line {} of {} needs initial, final and directory'.format(n + 1, manifest))
+            nebs.append({'initial': line[0], 'final': line[1], 'directory': line[2],
+                         'images': int(line[3]) if len(line) > 3 else images,
+                         'tolerance': float(line[4]) if len(line) > 4 else tolerance,
+                         'atom_pairs': [int(x) for x in line[5:]]})
+    return nebs
+
+
+def read_templates(folder):
+    """
+    :param folder: VASP run folder with INCAR, KPOINTS and POTCAR
+    :return: (Incar, Kpoints, Potcar)
+    """
+    return (Incar.from_file(os.path.join(folder, 'INCAR')), Kpoints.from_file(os.path.join(folder, 'KPOINTS')),
+            Potcar.from_file(os.path.join(folder, 'POTCAR')))
+
+
+def set_templates(folder):
+    # Pool initializer, so each worker reads the templates once
+    global templates
+    templates = read_templates(folder) if folder else None
+
+
+def make_neb(neb, ci=False, linear=False, assign=False, max_displacement=None, chgcar=False):
+    """
+    nebmake one line of the manifest, catching any failure
+
+    :param neb: dict from read_manifest
+    :return: dict of neb plus status, error and the displacement statistics of Helpers.get_image_distance between the
+        ends of the path (A)
+    """
+    result = dict(neb, status='failed', error='', total=np.nan, rms=np.nan, max=np.nan, max_atom=-1)
+    try:
+        os.makedirs(neb['directory'], exist_ok=True)
+        path = nebmake(neb['directory'], neb['initial'], neb['final'], neb['images'] + 1, neb['tolerance'], ci,
+                       poscar_override=neb['atom_pairs'], linear=linear, quickfail=True, assign=assign,
+                       max_displacement=max_displacement, templates=templates, chgcar=chgcar)
+        result.update(get_image_distance(path[0], path[-1]), status='done')
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+        try:
+            with open(os.path.join(neb['directory'], 'neb_batch_error.txt'), 'w') as f:
+                f.write(traceback.format_exc())
+        except OSError:  # directory could not be made, the error is still in the summary
+            pass
+    return result
+
+
+def write_summary(results, summary):
+    """
+    :param results: list of dicts from make_neb
+    :param summary: file to write to
+    """
+    with open(summary, 'w') as f:
+        f.write('{:<30} {:<8} {:>6} {:>10} {:>8} {:>8} {:>8}  {}\n'.format('directory', 'status', 'images', 'total (A)',
+                                                                          'rms (A)', 'max (A)', 'max_atom', 'error'))
+        for r in results:
+            f.write('{directory:<30} {status:<8} {images:>6} {total:>10.3f} {rms:>8.3f} {max:>8.3f} {max_atom:>8}  '
+                    '{error}\n'.format(**r))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('manifest', help='file with one "initial final directory [images [tolerance [atom_pairs]]]" '
+                                         'per line')
+    parser.add_argument('-p', '--processes', help='number of NEBs to build at once (default: number of cpus)',
+                        type=int, default=None)
+    parser.add_argument('-i', '--images', help='default number of images on string (Default: 7)',
+                        type=int, default=7)
+    parser.add_argument('-t', '--tolerance', help='default tolerance for matching structures (default: 0)',
+                        type=float, default=0)
+    parser.add_argument('-c', '--climbing_image', help='use CI', action='store_true')
+    parser.add_argument('--linear', help='Use linear interpolation instead of idpp', action='store_true')
+    parser.add_argument('--assign', help='pair atoms by minimum total displacement instead of by tolerance',
+                        action='store_true')
+    parser.add_argument('--max_displacement', help='with --assign, fail if any atom moves further than this (A)',
+                        type=float, default=None)
+    parser.add_argument('--chgcar', help='interpolate the CHGCARs of initial and final into the images (ICHARG = 1)',
+                        action='store_true')
+    parser.add_argument('--templates', help='folder with INCAR, KPOINTS and POTCAR used for every NEB '
+                                            '(default: those of each initial folder)', default=None)
+    parser.add_argument('-s', '--summary', help='summary file (default: neb_batch_summary.txt)',
+                        default='neb_batch_summary.txt')
+    args = parser.parse_args()
+
+    nebs = read_manifest(args.manifest, args.images, args.tolerance)
+    with ProcessPoolExecutor(args.processes, initializer=set_templates, initargs=(args.templates,)) as pool:
+        futures = [pool.submit(make_neb, neb, args.climbing_image, args.linear, args.assign, args.max_displacement,
+                               args.chgcar) for neb in nebs]
+        results = [future.result() for future in futures]
+    write_summary(results, args.summary)
+
+    failed = [r for r in results if r['status'] != 'done']
+    print('Built {} of {} NEBs, summary in {}'.format(len(results) - len(failed), len(results), args.summary))
+    for r in failed:
+        print('{}: {}'.format(r['directory'], r['error']))
@@ -4,7 +4,11 @@ import argparse
 from Classes_Pymatgen import *
 from pymatgen.core import PeriodicSite
 import os
+import sys
 import shutil
+import numpy as np
+from FileTools import seed_file, interpolate_chgcar
+from IDPP import idpp_interpolate
 
 def reorganize_structures(structure_1 : Structure, structure_2 : Structure, atoms=[], autosort_tol=0.5):
     """
@@ -48,28 +52,29 @@ def reorganize_structures(structure_1 : Structure, structure_2 : Structure, atom
             atom = atom
             new_s_2.append(atom.specie, atom.frac_coords, properties=atom.properties)
 
-        def sort_fxn(atom):
-            # return correct order for structure_1
-            i = 0
-            for s1_atom in structure_1: # type: PeriodicSite
-                if s1_atom.distance(atom) < 0.001 : # If site matches site in structure_1
-                    return i
-                i = i+1
-
-            # return correct order for structure_2
-            i=0
-            for s2_atom in atoms_2:
-                if s2_atom.distance(atom) < 0.01: # If atom should have been moved
-                    return atom_is_1[i] # where it should be in structure 1
-                i = i+1
-            i = 0
-            for s1_atom in structure_1: # type: PeriodicSite
-                if s1_atom.distance(atom) < autosort_tol : # If site is within auto_sort_tol of structure_1
-                    return i
-                i = i+1
-            raise Exception('FAILED SORT on: {}'.format(atom))
-        new_s_1.sort(sort_fxn)
-        new_s_2.sort(sort_fxn)
+        def get_sort_keys(structure):
+            # Where each site of structure belongs in structure_1, from periodic distance matrices
+            d_1 = structure_1.lattice.get_all_distances(structure.frac_coords, structure_1.frac_coords)
+            if atoms_2:
+                d_2 = structure_2.lattice.get_all_distances(structure.frac_coords, [a.frac_coords for a in atoms_2])
+            else:
+                d_2 = np.zeros((len(structure), 0))
+            keys = {}
+            for j, site in enumerate(structure):
+                if (d_1[j] < 0.001).any():  # If site matches site in structure_1
+                    keys[id(site)] = int(np.argmax(d_1[j] < 0.001))
+                elif (d_2[j] < 0.01).any():  # If atom should have been moved, where it should be in structure 1
+                    keys[id(site)] = atom_is_1[int(np.argmax(d_2[j] < 0.01))]
+                elif (d_1[j] < autosort_tol).any():  # If site is within auto_sort_tol of structure_1
+                    keys[id(site)] = int(np.argmax(d_1[j] < autosort_tol))
+                else:
+                    raise Exception('FAILED SORT on: {}'.format(site))
+            return keys
+
+        keys_1 = get_sort_keys(new_s_1)
+        keys_2 = get_sort_keys(new_s_2)
+        new_s_1.sort(lambda site: keys_1[id(site)])
+        new_s_2.sort(lambda site: keys_2[id(site)])
     else:
         new_s_1 = structure_1
         new_s_2 = structure_2_mutable
@@ -83,8 +88,59 @@ def reorganize_structures(structure_1 : Structure, structure_2 : Structure, atom
     return new_s_1, new_s_2
 
 
+def assign_atoms(structure_1 : Structure, structure_2 : Structure, atoms=[]):
+    """
+    Reorders structure_2 so that, species by species, the total minimum image displacement from structure_1 is as small
+    as possible (Hungarian assignment).  Vacancy and interstitial hops need no tolerance, the hopping atom is paired with
+    the site it moves to.
+
+    :param structure_1: Structure
+        Structure to interpolate between (order is kept)
+    :param structure_2: Structure
+        Structure to interpolate between
+    :param atoms:
+        list of tuples of atoms that should be the same between structures
+    :return: (Structure, np.array)
+        reordered structure_2 and the displacement (Angstrom) of each site
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    if len(structure_1) != len(structure_2):
+        raise Exception('Structures have different numbers of atoms: {} and {}'.format(len(structure_1), len(structure_2)))
+    species_1 = np.array([site.species_string for site in structure_1])
+    species_2 = np.array([site.species_string for site in structure_2])
+    order = np.full(len(structure_1), -1)
+    displacements = np.zeros(len(structure_1))
+    for i_1, i_2 in atoms:
+        order[i_1] = i_2
+        displacements[i_1] = structure_1.lattice.get_all_distances(structure_1[i_1].frac_coords,
+                                                                   structure_2[i_2].frac_coords)[0, 0]
+    paired_2 = set(i_2 for _, i_2 in atoms)
+
+    for specie in np.unique(species_1):
+        i_1s = np.array([i for i in np.where(species_1 == specie)[0] if order[i] < 0], dtype=int)
+        i_2s = np.array([i for i in np.where(species_2 == specie)[0] if i not in paired_2], dtype=int)
+        if len(i_1s) != len(i_2s):
+            raise Exception('Unpaired {} atoms differ between structures: {} and {}'.format(specie, len(i_1s), len(i_2s)))
+        if len(i_1s) == 0:
+            continue
+        cost = structure_1.lattice.get_all_distances(structure_1.frac_coords[i_1s], structure_2.frac_coords[i_2s])
+        rows, cols = linear_sum_assignment(cost)
+        order[i_1s[rows]] = i_2s[cols]
+        displacements[i_1s[rows]] = cost[rows, cols]
+
+    return Structure.from_sites([structure_2[i] for i in order]), displacements
+
+
 def nebmake(directory, start, final, images, tolerance=0,
-            ci=False, poscar_override=[], linear=False, write=True, start_i=0, quickfail=False):
+            ci=False, poscar_override=[], linear=False, write=True, start_i=0, quickfail=False, assign=False,
+            max_displacement=None, templates=None, chgcar=False):
+    """
+    Interpolates images between start and final and writes the NEB to directory.  With chgcar, the CHGCARs of start and
+    final are interpolated into every intermediate image and ICHARG = 1 is set.
+
+    :return: NEBPath of the images+1 structures
+    """
 
     if type(start) == str:
         start_POSCAR = os.path.join(start, 'CONTCAR') if os.path.exists(os.path.join(start, 'CONTCAR')) and os.path.getsize(os.path.join(start, 'CONTCAR')) > 0 else os.path.join(start, 'POSCAR')
@@ -102,54 +158,67 @@ def nebmake(directory, start, final, images, tolerance=0,
     if poscar_override:
         for i in range(int(len(poscar_override)/2)):
             atoms.append( (poscar_override[i*2], poscar_override[i*2+1]) )
+    if assign:
+        (s2, displacements) = assign_atoms(s1, s2, atoms=atoms)
+        tolerance=0
+        print('Total displacement: {:.3f} A  (max {:.3f} A on atom {})'.format(displacements.sum(), displacements.max(),
+                                                                               int(np.argmax(displacements))))
+        if max_displacement is not None and displacements.max() > max_displacement:
+            raise Exception('Atom {} moves {:.3f} A, more than {} A'.format(int(np.argmax(displacements)),
+                                                                            displacements.max(), max_displacement))
+    elif poscar_override:
         (s1, s2) = reorganize_structures(s1, s2, atoms=atoms, autosort_tol=tolerance)
         tolerance=0
     try:
         structures = s1.interpolate(s2, images, autosort_tol=tolerance)
     except Exception as e:
-        if quickfail:
+        if quickfail or assign:
             raise e
-        a=input('Failed.  Type y to sort --> ')
+        a=input('Failed.  Type y to sort, a to assign by displacement --> ') if sys.stdin.isatty() else 'a'
         if a=='y':
             s1.sort()
             s2.sort()
+        elif a=='a':
+            (s2, displacements) = assign_atoms(s1, s2, atoms=atoms)
+            print('Total displacement: {:.3f} A  (max {:.3f} A on atom {})'.format(
+                displacements.sum(), displacements.max(), int(np.argmax(displacements))))
         else:
             raise e
         structures = s1.interpolate(s2, images, autosort_tol=tolerance)
 
 
+    path = NEBPath.from_structures(structures, p1.selective_dynamics if type(start) == str else None)
     if not linear:
-        from pymatgen.io.ase import AseAtomsAdaptor
-        from ase.neb import NEB
-        structures_ase = [ AseAtomsAdaptor.get_atoms(struc) for struc in structures ]
-        neb = NEB(structures_ase)
-        neb.interpolate('idpp') # type: NEB
-        structures = [ AseAtomsAdaptor.get_structure(atoms) for atoms in neb.images ]
+        mask = None if path.selective_dynamics is None else path.selective_dynamics.astype(float)
+        path.coords[1:-1] = idpp_interpolate(path.coords[0], path.coords[-1], images, path.lattice.matrix, mask)[1:-1]
 
     if write:
         start_OUTCAR = os.path.join(start, 'OUTCAR')
         final_OUTCAR = os.path.join(final, 'OUTCAR')
-        incar = Incar.from_file(os.path.join(start, 'INCAR'))
-        kpoints = Kpoints.from_file(os.path.join(start, 'KPOINTS'))
-        potcar = Potcar.from_file(os.path.join(start, 'POTCAR'))
+        if templates:
+            (incar, kpoints, potcar) = (Incar(templates[0]), templates[1], templates[2])
+        else:
+            incar = Incar.from_file(os.path.join(start, 'INCAR'))
+            kpoints = Kpoints.from_file(os.path.join(start, 'KPOINTS'))
+            potcar = Potcar.from_file(os.path.join(start, 'POTCAR'))
         incar['ICHAIN'] = 0
         incar['IMAGES'] = images-1
         incar['LCLIMB'] = ci
 
-        for i, s in enumerate(structures):
-            folder = os.path.join(directory, str(i+start_i).zfill(2))
-            os.makedirs(folder, exist_ok=True)
-            Poscar(s, selective_dynamics=p1.selective_dynamics).write_file(os.path.join(folder, 'POSCAR'))
-            if i == 0:
-                shutil.copy(start_OUTCAR, os.path.join(folder, 'OUTCAR'))
-            if i == images:
-                shutil.copy(final_OUTCAR, os.path.join(folder, 'OUTCAR'))
-            i += 1
+        path.write_poscars(directory, start_i)
+        shutil.copy(start_OUTCAR, os.path.join(directory, str(start_i).zfill(2), 'OUTCAR'))
+        shutil.copy(final_OUTCAR, os.path.join(directory, str(images+start_i).zfill(2), 'OUTCAR'))
+        if chgcar:
+            interpolate_chgcar(os.path.join(start, 'CHGCAR'), os.path.join(final, 'CHGCAR'),
+                               [float(i)/images for i in range(1, images)],
+                               [os.path.join(directory, str(i+start_i).zfill(2), 'CHGCAR') for i in range(1, images)],
+                               structures=path[1:-1])
+            incar['ICHARG'] = 1
 
         incar.write_file(os.path.join(directory, 'INCAR'))
         kpoints.write_file(os.path.join(directory, 'KPOINTS'))
         potcar.write_file(os.path.join(directory, 'POTCAR'))
-    return structures
+    return path
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -165,20 +234,27 @@ if __name__ == '__main__':
     parser.add_argument('-c', '--climbing_image', help='use CI', action = 'store_true')
     parser.add_argument('-a', '--atom_pairs', help='pair certain atoms', type=int, nargs='*', default=[])
     parser.add_argument('--linear', help='Use linear interpolation instead of idpp', action='store_true')
+    parser.add_argument('--assign', help='pair atoms by minimum total displacement instead of by tolerance',
+                        action='store_true')
+    parser.add_argument('--max_displacement', help='with --assign, fail if any atom moves further than this (A)',
+                        type=float, default=None)
+    parser.add_argument('--chgcar', help='interpolate the CHGCARs of initial and final into the images (ICHARG = 1)',
+                        action='store_true')
     parser.add_argument('--sp_opt', help='Set up single_point optimization', action='store_true')
     parser.add_argument('--startindex', help='initialize index from something other than 0', type=int, default=0)
     args = parser.parse_args()
     if args.sp_opt:
         print('Initializing Structures')
-        nebmake(args.directory, args.initial, args.final, 1, args.tolerance, linear=True, poscar_override=args.atom_pairs)
+        nebmake(args.directory, args.initial, args.final, 1, args.tolerance, linear=True, poscar_override=args.atom_pairs,
+                assign=args.assign, max_displacement=args.max_displacement)
         for f in ['WAVECAR', 'CHGCAR']:
             print('Copying {}s'.format(f))
             try:
-                shutil.copy(os.path.join(args.initial, f), os.path.join(args.directory, '00', f))
+                seed_file(os.path.join(args.initial, f), os.path.join(args.directory, '00', f))
             except:
                 print('Failed copying initital')
             try:
-                shutil.copy(os.path.join(args.final, f), os.path.join(args.directory, '01', f))
+                seed_file(os.path.join(args.final, f), os.path.join(args.directory, '01', f))
             except:
                 print('Failed copying final')
         shutil.move('00', '0000')
@@ -194,4 +270,5 @@ if __name__ == '__main__':
         i.write_file(os.path.join(args.directory, 'INCAR'))
     else:
         nebmake(args.directory, args.initial, args.final, args.images+1, args.tolerance, args.climbing_image,
-                poscar_override=args.atom_pairs, linear=args.linear, start_i=args.startindex)
\ No newline at end of file
+                poscar_override=args.atom_pairs, linear=args.linear, start_i=args.startindex, assign=args.assign,
+                max_displacement=args.max_displacement, chgcar=args.chgcar)
\ No newline at end of file
@@ -5,6 +5,7 @@ import argparse
 import os
 import shutil
 from Classes_Pymatgen import *
+from FileTools import seed_file
 
 parser = argparse.ArgumentParser()
 parser.add_argument('start', help='magmom to check values from',
@@ -50,8 +51,8 @@ for i in range(start, end):
         poscar.write_file(os.path.join(dir, 'POSCAR'))
         potcar.write_file(os.path.join(dir, 'POTCAR'))
         if args.wavecar and os.path.exists('WAVECAR'):
-            shutil.copy('WAVECAR', os.path.join(dir,'WAVECAR'))
+            seed_file('WAVECAR', os.path.join(dir,'WAVECAR'))
             if os.path.exists('CHGCAR'):
-                shutil.copy('CHGCAR', os.path.join(dir, 'CHGCAR'))
+                seed_file('CHGCAR', os.path.join(dir, 'CHGCAR'))
     else:
         print('Folder exists:  ' + dir)
\ No newline at end of file
@@ -0,0 +1,121 @@
+# Reads everything we use from an OUTCAR in one pass over a memory map, and can pick up where it left off as the
+# OUTCAR grows
+# Not meant to be called from command line
+
+import os
+import re
+import mmap
+import numpy as np
+
+PATTERN = re.compile(
+    rb'NELECT\s*=\s*(?P<nelect>[-\d.]+)'
+    rb'|LOOP(?P<plus>\+?):\s*cpu time\s*[-\d.*]+:\s*real time\s*(?P<time>[-\d.]+)'
+    rb'|free  energy   TOTEN  =\s*(?P<toten>\S+) eV\s*\n\s*\n\s*energy  without entropy=\s*\S+\s+'
+    rb'energy\(sigma->0\) =\s*(?P<sigma0>\S+)'
+    rb'|POSITION\s+TOTAL-FORCE \(eV/Angst\)[ \t]*\n\s*-+[ \t]*\n(?P<forces>.*?)\n\s*-{10,}'
+    rb'|(?P<table>magnetization \(x\)|total charge)[ \t]*\n\s*\n# of ion(?P<orbitals>[^\n]*)\n-+[ \t]*\n'
+    rb'(?P<rows>.*?)\n-{10,}[ \t]*\ntot(?P<tot>[^\n]*)\n',
+    re.DOTALL)
+
+# Start of each multi-line block, so a block still being written at the end of the file is left for the next scan
+BLOCK_START = re.compile(rb'POSITION\s+TOTAL-FORCE|free  energy   TOTEN|(?:magnetization \(x\)|total charge)[ \t]*\n')
+TAIL = 1 << 22  # bytes at the end of the file checked for unfinished blocks
+HEAD = 1024  # bytes at the start of the file compared between scans, VASP writes its start time there
+
+
+class OutcarScanner:
+    """
+    NELECT, LOOP/LOOP+ timings, energies, positions and forces of each ionic step, and the last magnetization and charge
+    tables of an OUTCAR.  scan() only reads what was added since the last scan.
+    """
+
+    def __init__(self, filename='OUTCAR'):
+        self.filename = filename
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.identity = None  # (st_dev, st_ino, first HEAD bytes) of the file at the last scan
+        self.nelect = None
+        self.loop_times = []  # real time of each electronic step
+        self.loop_plus_times = []  # real time of each ionic step
+        self.energies = []  # free energy TOTEN of each ionic step
+        self.energies_sigma0 = []  # energy(sigma->0) of each ionic step
+        self.positions = []  # (n_atoms, 3) for each ionic step
+        self.forces = []  # (n_atoms, 3) for each ionic step
+        self.magnetization = []  # per ion dicts of orbital -> value, as Outcar.magnetization
+        self.total_magnetization = {}
+        self.charge = []  # per ion dicts of orbital -> value, as Outcar.charge
+        self.total_charge = {}
+
+    def get_end(self, mm):
+        # Last position that can be scanned safely: end of the last full line, before any unfinished block
+        end = mm.rfind(b'\n', self.offset) + 1
+        if end <= self.offset:
+            return self.offset
+        for start in BLOCK_START.finditer(mm, max(self.offset, end - TAIL), end):
+            if PATTERN.match(mm, start.start(), end) is None:
+                return start.start()
+        return end
+
+    def is_replaced(self, stat, head):
+        # True if the file is not the one scanned last time: a new file, a shorter one, or one rewritten from the start
+        if self.identity is None:
+            return False
+        dev, ino, last_head = self.identity
+        return (stat.st_dev, stat.st_ino) != (dev, ino) or stat.st_size < self.offset or \
+            not head.startswith(last_head)
+
+    def scan(self):
+        """
+        Reads the OUTCAR from where the last scan stopped.  Starts over if the file was replaced or rewritten since
+        (a restarted VASP), which is noticed from its inode, its size and its first bytes.
+
+        :return: self
+        """
+        if not os.path.exists(self.filename):
+            return self
+        with open(self.filename, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                return self
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                head = mm[:HEAD]
+                if self.is_replaced(stat, head):
+                    self.reset()
+                self.identity = (stat.st_dev, stat.st_ino, head)
+                end = self.get_end(mm)
+                for match in PATTERN.finditer(mm, self.offset, end):
+                    self.add(match)
+                self.offset = end
+        return self
+
+    def add(self, match):
+        if match.group('nelect') is not None:
+            self.nelect = float(match.group('nelect'))
+        elif match.group('time') is not None:
+            (self.loop_plus_times if match.group('plus') else self.loop_times).append(float(match.group('time')))
+        elif match.group('toten') is not None:
+            self.energies.append(float(match.group('toten')))
+            self.energies_sigma0.append(float(match.group('sigma0')))
+        elif match.group('forces') is not None:
+            table = np.array(match.group('forces').split(), dtype=float).reshape(-1, 6)
+            self.positions.append(table[:, :3])
+            self.forces.append(table[:, 3:])
+        elif match.group('table') is not None:
+            orbitals = match.group('orbitals').decode().split()
+            rows = [dict(zip(orbitals, map(float, row.split()[1:]))) for row in match.group('rows').decode().splitlines()
+                    if row.strip()]
+            total = dict(zip(orbitals, map(float, match.group('tot').split())))
+            if match.group('table') == b'total charge':
+                (self.charge, self.total_charge) = (rows, total)
+            else:
+                (self.magnetization, self.total_magnetization) = (rows, total)
+
+
+def scan_outcar(filename='OUTCAR'):
+    """
+    :param filename: OUTCAR
+    :return: OutcarScanner that has read all of filename
+    """
+    return OutcarScanner(filename).scan()
@@ -7,84 +7,66 @@ import sys
 import os
 from Classes_Pymatgen import *
 from pymatgen.io.vasp.outputs import *
+from OutcarScanner import scan_outcar
 
-def check_atoms(run1, run2):
-    o1 = Outcar(os.path.join(run1, 'OUTCAR'))
-    o2 = Outcar(os.path.join(run2, 'OUTCAR'))
-    v1 = Vasprun(os.path.join(run1, 'vasprun.xml'))
-    v2 = Vasprun(os.path.join(run2, 'vasprun.xml'))
+def load_run(run):
+    """
+    Reads what the checks need from a run folder: one pass over the OUTCAR and the atomic symbols from vasprun.xml
 
-    for i in range(len(v1.atomic_symbols)):
-        if v1.atomic_symbols[i] != v2.atomic_symbols[i]:
+    :return: (OutcarScanner, list of atomic symbols)
+    """
+    v = Vasprun(os.path.join(run, 'vasprun.xml'), parse_dos=False, parse_eigen=False, parse_projected_eigen=False)
+    return scan_outcar(os.path.join(run, 'OUTCAR')), v.atomic_symbols
+
+def check_atoms(run1, run2, loaded=None):
+    (_, symbols1), (_, symbols2) = loaded or (load_run(run1), load_run(run2))
+
+    for i in range(len(symbols1)):
+        if symbols1[i] != symbols2[i]:
             return False
     return True
 
-def check_magnetization(run1, run2, check_diff = 0.005, check_per = 0.05):
-    o1 = Outcar(os.path.join(run1, 'OUTCAR'))
-    o2 = Outcar(os.path.join(run2, 'OUTCAR'))
-    v1 = Vasprun(os.path.join(run1, 'vasprun.xml'))
-    v2 = Vasprun(os.path.join(run2, 'vasprun.xml'))
-
+def compare_tables(table1, table2, atomic_symbols, check_diff, check_per):
+    # Per ion and orbital differences between two magnetization or charge tables
     orbitals = ['p', 's', 'd', 'tot']
     difference = []
     prev_count = 0
     this_count = 0
     this_ion = ''
-    for i in range(len(o1.magnetization)):
-        if this_ion != v1.atomic_symbols[i]:
+    for i in range(len(table1)):
+        if this_ion != atomic_symbols[i]:
             prev_count = prev_count + this_count
             this_count = 0
-            this_ion = v1.atomic_symbols[i]
+            this_ion = atomic_symbols[i]
         for orb in orbitals:
-            m1 = o1.magnetization[i][orb]
-            m2 = o2.magnetization[i][orb]
+            m1 = table1[i][orb]
+            m2 = table2[i][orb]
             if abs(m1-m2) < check_diff:
                 continue
             elif (abs(m1) < 0.001 ) or (abs(m2) < 0.001):
-                difference.append([v1.atomic_symbols[i], i+1, orb, m1, m2])
+                difference.append([atomic_symbols[i], i+1, orb, m1, m2])
             elif abs(m1 - m2) / min(abs(m1),abs(m2)) <= check_per:
                 continue
             else:
-                difference.append([v1.atomic_symbols[i], i-prev_count+1, i+1, orb, m1, m2])
+                difference.append([atomic_symbols[i], i-prev_count+1, i+1, orb, m1, m2])
         this_count = this_count + 1
     return difference
 
-def check_charge(run1, run2, check_diff = 0.025, check_per = 0.00):
-    o1 = Outcar(os.path.join(run1, 'OUTCAR'))
-    o2 = Outcar(os.path.join(run2, 'OUTCAR'))
-    v1 = Vasprun(os.path.join(run1, 'vasprun.xml'))
-    v2 = Vasprun(os.path.join(run2, 'vasprun.xml'))
+def check_magnetization(run1, run2, check_diff = 0.005, check_per = 0.05, loaded=None):
+    (o1, symbols1), (o2, _) = loaded or (load_run(run1), load_run(run2))
+    return compare_tables(o1.magnetization, o2.magnetization, symbols1, check_diff, check_per)
 
-    orbitals = ['p', 's', 'd', 'tot']
-    difference = []
-    prev_count = 0
-    this_count = 0
-    this_ion = ''
-    for i in range(len(o1.charge)):
-        if this_ion != v1.atomic_symbols[i]:
-            prev_count = prev_count + this_count
-            this_count = 0
-            this_ion = v1.atomic_symbols[i]
-        for orb in orbitals:
-            m1 = o1.charge[i][orb]
-            m2 = o2.charge[i][orb]
-            if abs(m1-m2) < check_diff:
-                continue
-            elif (abs(m1) < 0.001 ) or (abs(m2) < 0.001):
-                difference.append([v1.atomic_symbols[i], i+1, orb, m1, m2])
-            elif abs(m1 - m2) / min(abs(m1),abs(m2)) <= check_per:
-                continue
-            else:
-                difference.append([v1.atomic_symbols[i], i-prev_count+1, i+1, orb, m1, m2])
-        this_count = this_count + 1
-    return difference
+def check_charge(run1, run2, check_diff = 0.025, check_per = 0.00, loaded=None):
+    (o1, symbols1), (o2, _) = loaded or (load_run(run1), load_run(run2))
+    return compare_tables(o1.charge, o2.charge, symbols1, check_diff, check_per)
 
 
 def verify_run(run1, run2):
-    if not check_atoms(run1, run2):
+    loaded = (load_run(run1), load_run(run2))
+    if not check_atoms(run1, run2, loaded):
         return 'Not the same Atoms'
-    mag = check_magnetization(run1, run2)
-    chg = check_charge(run1, run2)
+    mag = check_magnetization(run1, run2, loaded=loaded)
+    chg = check_charge(run1, run2, loaded=loaded)
     return (mag, chg)
 
 if os.path.basename(sys.argv[0]) == 'Verify.py':
@@ -1,36 +1,299 @@
-from Classes_Pymatgen import Vasprun, Structure, Poscar, Incar
+from Classes_Pymatgen import Vasprun, Structure, Poscar, Incar, NEBPath
 from custodian.custodian import Custodian
 from Classes_Custodian import StandardJob
 import os
 import shutil
 import logging
-from Neb_Make import nebmake
+import sys
+import asyncio
+import argparse
+import json
+import bisect
+import numpy as np
+from FileTools import seed_file, seed_tree, interpolate_chgcar
 from custodian.vasp.handlers import *
 
 
-def get_energy(i, structure: Structure, target=0.01):
+def get_nprocs():
+    """
+    Number of MPI ranks available to this job, from PBS_NP or SLURM_NTASKS
+
+    :return: int
+    """
+    if 'PBS_NP' in os.environ:
+        return int(os.environ['PBS_NP'])
+    elif 'SLURM_NTASKS' in os.environ:
+        return int(os.environ['SLURM_NTASKS'])
+    else:
+        return 1
+
+
+class EnergyIndex:
+    """
+    Append-only JSON-lines record (energies.jsonl) of the points evaluated by get_energy, keyed by path index.  A later
+    line for the same index replaces an earlier one.  The converged indices are kept sorted in memory so the nearest
+    converged neighbours are found by bisection instead of rescanning the directory, and new lines written by other
+    processes are picked up by reading from the last offset.
+    """
+
+    def __init__(self, directory='.', filename='energies.jsonl'):
+        self.directory = os.path.abspath(directory)
+        self.filename = os.path.join(self.directory, filename)
+        self.points = {}
+        self.converged = []
+        self._offset = 0
+        if not os.path.exists(self.filename):
+            self.rebuild()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Read any lines appended since the last refresh
+        """
+        if not os.path.exists(self.filename) or os.path.getsize(self.filename) == self._offset:
+            return
+        with open(self.filename, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):  # partially written by another process
+                    break
+                self._offset += len(line)
+                self._load(json.loads(line.decode()))
+
+    def _load(self, record):
+        i = record['i']
+        self.points[i] = record
+        j = bisect.bisect_left(self.converged, i)
+        present = j < len(self.converged) and self.converged[j] == i
+        if record['converged'] and not present:
+            self.converged.insert(j, i)
+        elif not record['converged'] and present:
+            self.converged.pop(j)
+
+    def get(self, i):
+        """
+        :param i: path index
+        :return: record for i or None
+        """
+        self.refresh()
+        return self.points.get(i)
+
+    def update(self, i, **fields):
+        """
+        Record new values for path index i
+
+        :param i: path index
+        :param fields: state, converged, energy, energy_above, energy_below, wavecar
+        :return: the full record
+        """
+        self.refresh()
+        record = {'i': i, 'state': 'new', 'converged': False, 'energy': None,
+                  'energy_above': None, 'energy_below': None, 'wavecar': None}
+        record.update(self.points.get(i, {}))
+        record.update(fields)
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        self.refresh()
+        return record
+
+    def nearest(self, i):
+        """
+        Closest converged points on either side of i
+
+        :param i: path index
+        :return: (below, above) indices, None if there is no converged point on that side
+        """
+        self.refresh()
+        j = bisect.bisect_left(self.converged, i)
+        below = self.converged[j - 1] if j > 0 else None
+        j = bisect.bisect_right(self.converged, i)
+        above = self.converged[j] if j < len(self.converged) else None
+        return below, above
+
+    def rebuild(self):
+        """
+        Index a search directory that was started before energies.jsonl existed.  Only folders with an energy.txt are
+        counted as converged.  energies.jsonl is created even if nothing is found, so the directory is only listed once.
+        """
+        for dir in sorted(os.listdir(self.directory)):
+            folder = os.path.join(self.directory, dir)
+            try:
+                dir_i = int(dir)
+            except ValueError:
+                continue
+            if not os.path.isfile(os.path.join(folder, 'energy.txt')):
+                continue
+            with open(os.path.join(folder, 'energy.txt'), 'r') as f:
+                energy = float(f.read().split()[0])
+            energy_above = None
+            energy_below = None
+            if os.path.exists(os.path.join(folder, 'above', 'vasprun.xml')) and \
+                    os.path.exists(os.path.join(folder, 'below', 'vasprun.xml')):
+                try:
+                    energy_above = Vasprun(os.path.join(folder, 'above', 'vasprun.xml')).final_energy
+                    energy_below = Vasprun(os.path.join(folder, 'below', 'vasprun.xml')).final_energy
+                except:  # TODO: Determine errors to be caught here
+                    energy_above = None
+                    energy_below = None
+            self.update(dir_i, **get_point_record(self.directory, dir_i, energy, energy_above, energy_below))
+        open(self.filename, 'a').close()
+
+
+def get_point_record(directory, i, energy, energy_above=None, energy_below=None):
+    """
+    Fields describing a finished point for EnergyIndex.update
+
+    :param directory: search directory
+    :param i: path index
+    :param energy: final energy
+    :param energy_above: final energy of the run seeded from above (if run)
+    :param energy_below: final energy of the run seeded from below (if run)
+    :return: dict
+    """
+    dir = str(i).zfill(4)
+    if os.path.exists(os.path.join(directory, dir, 'WAVECAR')):
+        wavecar = dir
+    elif energy_above is not None and energy_below is not None:
+        wavecar = os.path.join(dir, 'above' if energy_above < energy_below else 'below')
+    else:
+        wavecar = None
+    return {'state': 'done', 'converged': True, 'energy': energy, 'energy_above': energy_above,
+            'energy_below': energy_below, 'wavecar': wavecar}
+
+
+energy_backend = None
+
+
+def set_energy_backend(backend):
+    """
+    Replace VASP in get_energy with another energy calculator, e.g. Benchmark_TS.AnalyticPES.  Folders, POSCARs,
+    energy.txt and energies.jsonl are still written, so every TS search works unchanged.
+
+    :param backend: callable (i, Structure) -> energy in eV, or None to use VASP again
+    :return:
+    """
+    global energy_backend
+    energy_backend = backend
+
+
+chgcar_seeding = False
+
+
+def set_chgcar_seeding(enabled):
+    """
+    Start new get_energy runs from the CHGCARs of the closest converged points on both sides, linearly interpolated to
+    the new point (ICHARG = 1), instead of from a copy of the closest one's CHGCAR
+
+    :param enabled: bool
+    :return:
+    """
+    global chgcar_seeding
+    chgcar_seeding = enabled
+
+
+def seed_chgcar(directory, i, structure: Structure, neighbors, output):
+    """
+    Interpolate the CHGCARs of the converged points below and above i to output
+
+    :param directory: search directory
+    :param i: index of the new point
+    :param structure: Structure of the new point
+    :param neighbors: dict of EnergyIndex records with keys 'below' and 'above'
+    :param output: CHGCAR to write
+    :return: True if output was written
+    """
+    below, above = neighbors['below'], neighbors['above']
+    if not (below and above and below['wavecar'] and above['wavecar']):
+        return False
+    chgcars = [os.path.join(directory, n['wavecar'], 'CHGCAR') for n in [below, above]]
+    if not all(os.path.exists(chgcar) and os.path.getsize(chgcar) > 0 for chgcar in chgcars):
+        return False
+    try:
+        interpolate_chgcar(chgcars[0], chgcars[1], [float(i - below['i']) / (above['i'] - below['i'])], [output],
+                           structures=[structure])
+    except Exception as e:
+        logging.info('Could not interpolate CHGCAR for {}: {}'.format(i, e))
+        return False
+    logging.info('Interpolated CHGCAR from {} and {}'.format(below['wavecar'], above['wavecar']))
+    return True
+
+
+def get_energy(i, structure: Structure, target=0.01, nprocs=None):
     """
     get_energy finds the energy of the structure at location i along the interpolated pathway
 
     :param i: folder for structure to be placed in (i >=0 and i < 1000)
     :param structure: Structure
     :param target: energy convergence criteria
+    :param nprocs: number of MPI ranks to run VASP on (Default: whole allocation)
     :return: energy in eV
     """
+    if energy_backend is not None:
+        return get_backend_energy(i, structure)
+    energy = get_energy_step(i, structure, target, nprocs)
+    while energy is None:
+        energy = get_energy_step(i, structure, target, nprocs)
+    return energy
 
-    # Setup Run
+
+def get_backend_energy(i, structure: Structure):
+    """
+    get_energy using the calculator set with set_energy_backend
+
+    :param i: folder for structure to be placed in (i >=0 and i < 1000)
+    :param structure: Structure
+    :return: energy in eV
+    """
     cwd = os.path.abspath('.')
-    handlers = [VaspErrorHandler('vasp.log'), PositiveEnergyErrorHandler(), NonConvergingErrorHandler(nionic_steps=10)]
-    settings = [
-        {'dict': 'INCAR',
-         'action': {'_set': {'NSW': 5000,
-                             'IOPT': 0,
-                             'IBRION': 3,
-                             'EDIFFG': 1e-3,
-                             'POTIM': 0},
-                    }}
-    ]
     folder = os.path.join(cwd, str(i).zfill(4))
+    index = EnergyIndex(cwd)
+    record = index.get(i)
+    if record and record['converged']:
+        return record['energy']
+    os.makedirs(folder, exist_ok=True)
+    Poscar(structure).write_file(os.path.join(folder, 'POSCAR'))
+    energy = energy_backend(i, structure)
+    with open(os.path.join(folder, 'energy.txt'), 'w') as f:
+        f.write(str(energy))
+    index.update(i, **get_point_record(cwd, i, energy))
+    return energy
+
+
+def get_energy_step(i, structure: Structure, target=0.01, nprocs=None):
+    """
+    One pass of get_energy.  Returns the energy if the point is finished, otherwise runs the calculations that are
+    still needed and returns None
+
+    :param i: folder for structure to be placed in (i >=0 and i < 1000)
+    :param structure: Structure
+    :param target: energy convergence criteria
+    :param nprocs: number of MPI ranks to run VASP on (Default: whole allocation)
+    :return: energy in eV or None
+    """
+    energy, run_folders = prepare_energy(i, structure, target)
+    for run_folder in run_folders:
+        run_vasp(run_folder, nprocs)
+    return energy
+
+
+def prepare_energy(i, structure: Structure, target=0.01, directory='.'):
+    """
+    Works out what is left to do for the structure at location i without changing the working directory.  If the point
+    is finished its energy is returned, otherwise the above and below folders are initialized from the closest
+    converged runs and the ones that still need a VASP run are returned.
+
+    :param i: folder for structure to be placed in (i >=0 and i < 1000)
+    :param structure: Structure
+    :param target: energy convergence criteria
+    :param directory: search directory holding INCAR, KPOINTS, POTCAR and the numbered folders
+    :return: (energy in eV or None, list of folders to run VASP in)
+    """
+    cwd = os.path.abspath(directory)
+    folder = os.path.join(cwd, str(i).zfill(4))
+    index = EnergyIndex(cwd)
+    record = index.get(i)
+    if record and record['converged']:
+        return record['energy'], []
 
     # Check if Run has occured
     if os.path.exists(folder):  # if it has
@@ -39,166 +302,579 @@ def get_energy(i, structure: Structure, target=0.01):
             vasprun_above = Vasprun(os.path.join(folder, 'above', 'vasprun.xml'))
             vasprun_below = Vasprun(os.path.join(folder, 'below', 'vasprun.xml'))
             if vasprun_above.converged and vasprun_below.converged:
+                energy = min(vasprun_above.final_energy, vasprun_below.final_energy)
                 with open(os.path.join(folder, 'energy.txt'), 'w') as f:
-                    f.write(str(min(vasprun_above.final_energy, vasprun_below.final_energy)))
-                return min(vasprun_above.final_energy, vasprun_below.final_energy)
+                    f.write(str(energy))
+                index.update(i, **get_point_record(cwd, i, energy, vasprun_above.final_energy,
+                                                   vasprun_below.final_energy))
+                return energy, []
         except:  # TODO: Determine errors to be caught here
             try:  # If run is not completed, see if override is provided
                 if os.path.exists(os.path.join(folder, 'energy.txt')):
                     with open(os.path.join(folder, 'energy.txt'), 'r') as f:
                         energy = float(f.read().split()[0])
-                    return energy
+                    index.update(i, **get_point_record(cwd, i, energy))
+                    return energy, []
                 else:  # see if simple run was performed and check for energy
-                    shutil.copy('INCAR', os.path.join(folder, 'INCAR'))
+                    shutil.copy(os.path.join(cwd, 'INCAR'), os.path.join(folder, 'INCAR'))
                     vasprun = Vasprun(os.path.join(folder, 'vasprun.xml'))
                     with open(os.path.join(folder, 'energy.txt'), 'w') as f:
                         f.write(str(vasprun.final_energy))
-                    return vasprun.final_energy
+                    index.update(i, **get_point_record(cwd, i, vasprun.final_energy))
+                    return vasprun.final_energy, []
             except:  # TODO: Determine errors to be caught here
                 pass
     # If the run was not performed, restart calculation
     else:
         os.mkdir(folder)
-    above = None
-    below = None
+    if record is None:
+        index.update(i, state='running')
 
-    # Initialize from previous runs
-    for dir in [dir for dir in os.listdir(cwd) if os.path.isdir(os.path.join(cwd, dir))]:  # determine closest runs
-        try:
-            dir_i = int(dir)
-            if i == dir_i:
-                pass
-            if dir_i > i:
-                if above is None:
-                    above = dir_i
-                elif dir_i - i < above - i:
-                    above = dir_i
-            elif dir_i < i:
-                if below is None:
-                    below = dir_i
-                elif abs(dir_i - i) < abs(below - i):
-                    below = dir_i
-
-            elif closest is None:
-                closest = dir
-            elif abs(i - int(closest)) >= abs(i - int(dir)):
-                closest = dir
-        except:
-            pass
-    same_wfxns = 0
-    for dir_i, dir in [(str(above).zfill(4), 'above'), (str(below).zfill(4), 'below')]:
+    # Initialize from the closest converged runs
+    below, above = index.nearest(i)
+    neighbors = {'above': index.get(above) if above is not None else None,
+                 'below': index.get(below) if below is not None else None}
+    # If above and below are the same on both sides, we do not need to do above and below differently
+    same_wfxns = all(n and n['energy_above'] is not None and n['energy_below'] is not None and
+                     n['energy_above'] - n['energy_below'] < target for n in neighbors.values())
+    run_folders = []
+    seeded_chgcar = None
+    for dir in ['above', 'below']:
+        run_folder = os.path.join(folder, dir)
         try:  # Load vasprun and check if individual folders have converged
-            vasprun = Vasprun(os.path.join(folder, dir, 'vasprun.xml'))
+            vasprun = Vasprun(os.path.join(run_folder, 'vasprun.xml'))
             if vasprun.converged:
-                pass
+                continue
             else:
                 raise Exception('Not Converged')
         except:  # if the run has not converged, setup a calculation
-            os.makedirs(os.path.join(folder, dir), exist_ok=True)
-            if not os.path.exists(os.path.join(folder, dir, 'WAVECAR')):  # check if files exist to initialize run
-                try:  # copy them if provided
-                    shutil.copy(os.path.join(dir_i, 'WAVECAR'), os.path.join(folder, dir, 'WAVECAR'))
-                    shutil.copy(os.path.join(dir_i, 'CHGCAR'), os.path.join(folder, dir, 'CHGCAR'))
-                    logging.info('Copied from {} to {} (in main dir)'.format(dir_i, os.path.join(folder, dir)))
-                except:  # if not, see if initialization exists in other folders
-                    if os.path.exists(os.path.join(dir_i, 'above', 'vasprun.xml')) and \
-                            os.path.exists(os.path.join(dir_i, 'below', 'vasprun.xml')):
-                        vasprun_above = Vasprun(os.path.join(dir_i, 'above', 'vasprun.xml'))
-                        vasprun_below = Vasprun(os.path.join(dir_i, 'below', 'vasprun.xml'))
-                        if vasprun_above.final_energy < vasprun_below.final_energy:
-                            lowest_dir = 'above'
-                        else:
-                            lowest_dir = 'below'
-                        shutil.copy(os.path.join(dir_i, lowest_dir, 'WAVECAR'), os.path.join(folder, dir, 'WAVECAR'))
-                        shutil.copy(os.path.join(dir_i, lowest_dir, 'CHGCAR'), os.path.join(folder, dir, 'CHGCAR'))
-                        logging.info(
-                            'Copied from {} to {}'.format(os.path.join(dir_i, lowest_dir), os.path.join(folder, dir)))
-                        if vasprun_above.final_energy - vasprun_below.final_energy < target:
-                            same_wfxns += 1
-
-            if same_wfxns == 2:  # If above and below are the same, we do not need to do above and below differently:
-                logging.info('Wavefunctions are the same')
-                if os.path.exists(os.path.join(folder, 'below')):
-                    shutil.rmtree(os.path.join(folder, 'below'))
-                shutil.copytree(os.path.join(folder, 'above'), os.path.join(folder, 'below'))
-                os.chdir(folder)
-                os.chdir(dir)
-            else:  # Otherwise don't copy anything between above and below
-                shutil.copy('INCAR', os.path.join(folder, dir, 'INCAR'))
-                shutil.copy('KPOINTS', os.path.join(folder, dir, 'KPOINTS'))
-                shutil.copy('POTCAR', os.path.join(folder, dir, 'POTCAR'))
-                os.chdir(folder)
-                os.chdir(dir)
-                Poscar(structure).write_file('POSCAR')
-                incar = Incar.from_file('INCAR')
-                if 'AUTO_GAMMA' in incar and incar['AUTO_GAMMA']:
-                    vasp = os.environ['VASP_GAMMA']
-                else:
-                    vasp = os.environ['VASP_KPTS']
-                incar.write_file('INCAR')
-
-                if os.environ['VASP_MPI'] == 'srun':
-                    j = StandardJob([os.environ['VASP_MPI'], vasp], 'vasp.log', auto_npar=False, final=True,
-                                    settings_override=settings)
-                else:
-                    j = StandardJob([os.environ['VASP_MPI'], '-np', os.environ['PBS_NP'], vasp], 'vasp.log',
-                                    auto_npar=False, final=True, settings_override=settings)
-                c = Custodian(handlers, [j], max_errors=10)
-                c.run()
-            os.chdir(cwd)
-    return get_energy(i, structure)
-
-
-def get_ts(low, mp, high, target=0.01):
-    """
-    Find TS from string of structures using a ternary search
+            pass
+        if same_wfxns and dir == 'below':
+            if run_folders:  # above has to finish first
+                continue
+            logging.info('Wavefunctions are the same')
+            if os.path.exists(run_folder):
+                shutil.rmtree(run_folder)
+            seed_tree(os.path.join(folder, 'above'), run_folder, hardlink=True)  # neither copy is run again
+            continue
+
+        os.makedirs(run_folder, exist_ok=True)
+        neighbor = neighbors[dir]
+        interpolated = False
+        if neighbor and neighbor['wavecar'] and not os.path.exists(os.path.join(run_folder, 'WAVECAR')):
+            if chgcar_seeding and seeded_chgcar:  # same interpolation as the other side
+                interpolated = seed_file(seeded_chgcar, os.path.join(run_folder, 'CHGCAR'))
+            elif chgcar_seeding and seed_chgcar(cwd, i, structure, neighbors, os.path.join(run_folder, 'CHGCAR')):
+                interpolated = seeded_chgcar = os.path.join(run_folder, 'CHGCAR')
+            try:  # initialize from neighbor
+                seed_file(os.path.join(cwd, neighbor['wavecar'], 'WAVECAR'), os.path.join(run_folder, 'WAVECAR'))
+                if not interpolated:
+                    seed_file(os.path.join(cwd, neighbor['wavecar'], 'CHGCAR'), os.path.join(run_folder, 'CHGCAR'))
+                logging.info('Copied from {} to {}'.format(neighbor['wavecar'], run_folder))
+            except:
+                logging.info('Could not copy from {}'.format(neighbor['wavecar']))
+        for f in ['INCAR', 'KPOINTS', 'POTCAR']:
+            shutil.copy(os.path.join(cwd, f), os.path.join(run_folder, f))
+        if interpolated:
+            incar = Incar.from_file(os.path.join(run_folder, 'INCAR'))
+            incar['ICHARG'] = 1
+            incar.write_file(os.path.join(run_folder, 'INCAR'))
+        Poscar(structure).write_file(os.path.join(run_folder, 'POSCAR'))
+        run_folders.append(run_folder)
+    return None, run_folders
+
+
+def get_vasp_command(incar, nprocs=None, hostfile=None):
+    """
+    Command to run VASP with for get_energy
+
+    :param incar: Incar of the run
+    :param nprocs: number of MPI ranks to run VASP on (Default: whole allocation)
+    :param hostfile: file of hosts for mpirun to start the ranks on, ignored by srun (Default: let mpirun choose)
+    :return: list
+    """
+    if 'AUTO_GAMMA' in incar and incar['AUTO_GAMMA']:
+        vasp = os.environ['VASP_GAMMA']
+    else:
+        vasp = os.environ['VASP_KPTS']
+    if os.environ['VASP_MPI'] == 'srun' and nprocs is None:
+        return [os.environ['VASP_MPI'], vasp]
+    elif os.environ['VASP_MPI'] == 'srun':
+        return [os.environ['VASP_MPI'], '--exclusive', '-n', str(nprocs), vasp]
+    else:
+        ranks = str(nprocs) if nprocs else os.environ['PBS_NP']
+        if hostfile:
+            return [os.environ['VASP_MPI'], '-np', ranks, '-machinefile', os.path.abspath(hostfile), vasp]
+        return [os.environ['VASP_MPI'], '-np', ranks, vasp]
+
+
+def run_vasp(folder, nprocs=None, hostfile=None):
+    """
+    Run VASP under custodian in a folder set up by prepare_energy
+
+    :param folder: folder to run in
+    :param nprocs: number of MPI ranks to run VASP on (Default: whole allocation)
+    :param hostfile: file of hosts to start the ranks on, see get_vasp_command
+    :return:
+    """
+    cwd = os.path.abspath('.')
+    handlers = [VaspErrorHandler('vasp.log'), PositiveEnergyErrorHandler(), NonConvergingErrorHandler(nionic_steps=10)]
+    settings = [
+        {'dict': 'INCAR',
+         'action': {'_set': {'NSW': 5000,
+                             'IOPT': 0,
+                             'IBRION': 3,
+                             'EDIFFG': 1e-3,
+                             'POTIM': 0},
+                    }}
+    ]
+    command = get_vasp_command(Incar.from_file(os.path.join(folder, 'INCAR')), nprocs, hostfile)
+    os.chdir(folder)
+    try:
+        j = StandardJob(command, 'vasp.log', auto_npar=False, final=True,
+                        settings_override=settings)
+        c = Custodian(handlers, [j], max_errors=10)
+        c.run()
+    finally:
+        os.chdir(cwd)
+
+
+def get_hosts():
+    """
+    Hosts of the MPI slots of this job, one line per rank, from PBS_NODEFILE
+
+    :return: list of host names, empty if there is no PBS_NODEFILE
+    """
+    if 'PBS_NODEFILE' in os.environ and os.path.exists(os.environ['PBS_NODEFILE']):
+        with open(os.environ['PBS_NODEFILE']) as f:
+            return [l.strip() for l in f if l.strip()]
+    return []
+
+
+def split_allocation(n, nprocs=None):
+    """
+    Share the MPI ranks of this job between n VASP runs going at once.  srun places each run on free cores itself
+    (--exclusive), other launchers get their own contiguous block of PBS_NODEFILE to use as a hostfile, as mpirun would
+    otherwise start every run on the first nodes of the job.
+
+    :param n: number of runs at once, at most one per rank
+    :param nprocs: number of MPI ranks for each run (Default: even share of the job)
+    :return: list of (nprocs, hosts) for each run, hosts is empty under srun; None if the job can't be split
+    """
+    if os.environ.get('VASP_MPI') == 'srun':
+        n = max(min(n, get_nprocs()), 1)
+        return [(nprocs or max(get_nprocs() // n, 1), [])] * n
+    hosts = get_hosts()
+    if not hosts:
+        return None
+    n = max(min(n, len(hosts)), 1)
+    size, extra = divmod(len(hosts), n)
+    slots, start = [], 0
+    for k in range(n):
+        block = hosts[start:start + size + (k < extra)]
+        start += len(block)
+        slots.append((nprocs or len(block), block))
+    return slots
+
+
+async def get_energy_async(i, structure: Structure, target=0.01, directory='.', slots=None):
+    """
+    get_energy as an asyncio task.  Each VASP run is a separate `algorithms.py` subprocess started in its own folder,
+    so the working directory of this process is never changed and many points can run at once.
+
+    :param i: folder for structure to be placed in (i >=0 and i < 1000)
+    :param structure: Structure
+    :param target: energy convergence criteria
+    :param directory: search directory
+    :param slots: asyncio.Queue of the (nprocs, hosts) shares of split_allocation, each VASP run takes one while it goes
+        (Default: one run at a time on the whole allocation)
+    :return: energy in eV, raises RuntimeError if a VASP run fails
+    """
+    if slots is None:
+        slots = asyncio.Queue()
+        slots.put_nowait((None, []))
+
+    async def run(run_folder):
+        nprocs, hosts = await slots.get()
+        try:
+            cmd = [sys.executable, os.path.abspath(__file__), run_folder]
+            if nprocs:
+                cmd += ['-n', str(nprocs)]
+            if hosts:
+                hostfile = os.path.join(run_folder, 'hostfile')
+                with open(hostfile, 'w') as f:
+                    f.write('\n'.join(hosts) + '\n')
+                cmd += ['--hostfile', hostfile]
+            logging.info('Running VASP in {}'.format(run_folder))
+            process = await asyncio.create_subprocess_exec(*cmd, cwd=run_folder)
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:  # another point failed, don't leave its VASP running
+                process.kill()
+                raise
+            if returncode != 0:
+                # custodian already retried up to its error limit, so running the folder again would fail the same way
+                raise RuntimeError('VASP run in {} exited with {}'.format(run_folder, returncode))
+        finally:
+            slots.put_nowait((nprocs, hosts))
+
+    while True:
+        energy, run_folders = prepare_energy(i, structure, target, directory)
+        if energy is not None:
+            return energy
+        await asyncio.gather(*[run(run_folder) for run_folder in run_folders])
+
+
+def get_energies_async(points, target=0.01, max_concurrent=None, nprocs=None, directory='.'):
+    """
+    Evaluate many points at once with asyncio, see get_energy_async
+
+    :param points: list of (i, Structure) tuples, see get_energy
+    :param target: energy convergence criteria
+    :param max_concurrent: most VASP runs at once (Default: one per point, at most one per MPI rank of the job)
+    :param nprocs: number of MPI ranks for each VASP run (Default: even share of the job, see split_allocation)
+    :param directory: search directory
+    :return: list of energies in eV, in the same order as points
+    """
+    shares = split_allocation(max_concurrent or len(points), nprocs)
+    if shares is None:
+        logging.warning('Can not split the job between runs of {} without a PBS_NODEFILE, running one at a '
+                        'time'.format(os.environ.get('VASP_MPI')))
+        shares = [(nprocs, [])]
+
+    async def evaluate():
+        slots = asyncio.Queue()
+        for share in shares:
+            slots.put_nowait(share)
+        return await asyncio.gather(*[get_energy_async(i, structure, target, directory, slots)
+                                      for i, structure in points])
+
+    logging.info('Running {} points, {} VASP runs at a time'.format(len(points), len(shares)))
+    return asyncio.run(evaluate())
+
+
+def get_energies(points, target=0.01, parallel=False):
+    """
+    get_energies finds the energies of several structures along the interpolated pathway.  If parallel is set, the
+    points are run at the same time, each on an even share of the MPI ranks of the job (see get_energies_async).
+    Launchers other than srun need a PBS_NODEFILE to split the job between the runs, without one the points are run one
+    by one.
+
+    :param points: list of (i, Structure) tuples, see get_energy
+    :param target: energy convergence criteria
+    :param parallel: run all points at the same time
+    :return: list of energies in eV, in the same order as points
+    """
+    unique = {}
+    for i, structure in points:  # the same folder can't be run twice at once
+        unique.setdefault(i, structure)
+    if parallel and len(unique) > 1 and energy_backend is None and split_allocation(len(unique)) is None:
+        logging.warning('Can not split the job between runs of {} without a PBS_NODEFILE, running points one at a '
+                        'time'.format(os.environ.get('VASP_MPI')))
+        parallel = False
+    if parallel and len(unique) > 1 and energy_backend is None:
+        energies = get_energies_async(list(unique.items()), target)
+        energies = dict(zip(unique, energies))
+    else:
+        energies = {i: get_energy(i, structure, target) for i, structure in unique.items()}
+    return [energies[i] for i, _ in points]
+
+
+def read_checkpoint(checkpoint, method, start, target):
+    """
+    Load the state of a TS search, or a fresh state if checkpoint is missing or belongs to a different search
+
+    :param checkpoint: checkpoint file
+    :param method: name of the search
+    :param start: initial bracket of the search
+    :param target: Convergence criteria
+    :return: dict
+    """
+    if os.path.exists(checkpoint):
+        with open(checkpoint, 'r') as f:
+            state = json.load(f)
+        if state['method'] == method and state['start'] == list(start):
+            state['energies'] = {int(i): e for i, e in state['energies'].items()}
+            logging.info('Resuming {} search from {}'.format(method, checkpoint))
+            return state
+    return {'method': method, 'start': list(start), 'target': target, 'status': 'running', 'bracket': list(start),
+            'pending': [], 'energies': {}, 'history': [], 'ts': None}
+
+
+def write_checkpoint(checkpoint, state):
+    """
+    Atomically write the state of a TS search
+
+    :param checkpoint: checkpoint file
+    :param state: dict from read_checkpoint
+    :return:
+    """
+    with open(checkpoint + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(checkpoint + '.tmp', checkpoint)
+
+
+def get_ts(low, mp, high, target=0.01, parallel=False, checkpoint='get_ts.json'):
+    """
+    Find TS from string of structures using a ternary search.  The bracket, every energy found and the points being
+    run are written to checkpoint after each step, so a restarted job continues from the last bracket.
     :param low: low end index
     :param mp: midpoint index
     :param high: high ened index
     :param target: Convergence criteria
+    :param parallel: evaluate the endpoints and the quartiles concurrently (see get_energies)
+    :param checkpoint: file to save progress to
     :return: ts Structure
     """
-    logging.info('Finding Max from locations : {} {} {}'.format(low, mp, high))
+    state = read_checkpoint(checkpoint, 'ternary', [low, mp, high], target)
+    if state['status'] == 'converged':
+        return state['ts']
+    low, mp, high = state['bracket']
+    energies = state['energies']
+
+    def evaluate(points):
+        todo = [(i, structure) for i, structure in points if i not in energies]
+        state['pending'] = [i for i, _ in todo]
+        write_checkpoint(checkpoint, state)
+        for i, energy in zip(state['pending'], get_energies(todo, target, parallel)):
+            energies[i] = energy
+        state['pending'] = []
+        write_checkpoint(checkpoint, state)
+        return [energies[i] for i, _ in points]
+
+    while True:
+        logging.info('Finding Max from locations : {} {} {}'.format(low, mp, high))
+        state['bracket'] = [low, mp, high]
+
+        # Initialize the high and low points
+        start_struct = Structure.from_file(os.path.join(str(low).zfill(4), 'POSCAR'))
+        final_struct = Structure.from_file(os.path.join(str(high).zfill(4), 'POSCAR'))
+        if os.path.exists(os.path.join(str(mp).zfill(4), 'POSCAR')):
+            mp_struct = Structure.from_file(os.path.join(str(mp).zfill(4), 'POSCAR'))
+        else:
+            mp_struct = NEBPath.from_structures([start_struct, final_struct]).get_image(0.5)
+
+        # Get energy of high and low structures
+        low_e, high_e = evaluate([(low, start_struct), (high, final_struct)])
+        logging.info('Converging Midpoint')
+        mp_e, = evaluate([(mp, mp_struct)])
+
+        # Check if converged due to lack of resolution or reaching convergence criteria
+        if mp == low or mp == high or (abs(mp_e - high_e) < target and abs(mp_e - low_e) < target):
+            logging.info('Found Max at : {} with E= {:.10}'.format(mp, mp_e))
+            state['status'] = 'converged'
+            state['ts'] = mp
+            write_checkpoint(checkpoint, state)
+            return mp
+        path = NEBPath.from_structures([start_struct, mp_struct, final_struct])
+        q1_struct = path[0:2].get_image(0.5)
+        q3_struct = path[1:3].get_image(0.5)
+
+        # If not eliminate highest energy quartile and search again
+        q1 = int((low + mp) / 2)
+        q3 = int((high + mp) / 2)
+        logging.info('Converging Q1 and Q3')
+        q1_e, q3_e = evaluate([(q1, q1_struct), (q3, q3_struct)])
+        logging.info('Locations : {:<12} {:<12} {:<12}'.format(q1, mp, q3))
+        logging.info('Energies  : {:.10} {:.10} {:.10}'.format(q1_e, mp_e, q3_e))
+        state['history'].append({'locations': [q1, mp, q3], 'energies': [q1_e, mp_e, q3_e]})
+        if q3_e >= mp_e and q3_e >= q1_e:
+            low, mp, high = mp, q3, high
+        elif mp_e >= q1_e and mp_e >= q3_e:
+            low, mp, high = q1, mp, q3
+        elif q1_e >= mp_e and q1_e >= q3_e:
+            low, mp, high = low, q1, mp
+        else:
+            raise Exception('Unknown error occured, check algorithms.py file')
+        state['bracket'] = [low, mp, high]
+        write_checkpoint(checkpoint, state)
 
-    # Initialize the high and low points
+
+def get_structure(i, low, high):
+    """
+    Structure at location i along the interpolated pathway.  Uses the POSCAR in folder i if it exists, otherwise
+    interpolates between the POSCARs in folders low and high with IDPP, like get_ts
+
+    :param i: index of structure (low <= i <= high)
+    :param low: index of an evaluated point below i
+    :param high: index of an evaluated point above i
+    :return: Structure
+    """
+    if os.path.exists(os.path.join(str(i).zfill(4), 'POSCAR')):
+        return Structure.from_file(os.path.join(str(i).zfill(4), 'POSCAR'))
     start_struct = Structure.from_file(os.path.join(str(low).zfill(4), 'POSCAR'))
     final_struct = Structure.from_file(os.path.join(str(high).zfill(4), 'POSCAR'))
-    if os.path.exists(os.path.join(str(mp).zfill(4), 'POSCAR')):
-        mp_struct = Structure.from_file(os.path.join(str(mp).zfill(4), 'POSCAR'))
-    else:
-        mp_struct = nebmake('.', start_struct, final_struct, 2, write=False)[1]
-
-    # Get energy of high and low structures
-    low_e = get_energy(low, start_struct)
-    high_e = get_energy(high, final_struct)
-    logging.info('Converging Midpoint')
-    mp_e = get_energy(mp, mp_struct)
-
-    # Check if converged due to lack of resolution
-    if mp == low or mp == high:
-        logging.info('Found Max at : {} with E= {:.10}'.format(mp, mp_e))
-        return mp
-    # Check if converged due to reaching convergence criteria
-    if abs(mp_e - high_e) < target and abs(mp_e - low_e) < target:
-        logging.info('Found Max at : {} with E= {:.10}'.format(mp, mp_e))
-        return mp
-    q1_struct = nebmake('.', start_struct, mp_struct, 2, write=False)[1]
-    q3_struct = nebmake('.', mp_struct, final_struct, 2, write=False)[1]
-
-    # If not eliminate highest energy quartile and search again
-    q1 = int((low + mp) / 2)
-    q3 = int((high + mp) / 2)
-    logging.info('Converging Q1')
-    q1_e = get_energy(q1, q1_struct)
-    logging.info('Converging Q3')
-    q3_e = get_energy(q3, q3_struct)
-    logging.info('Locations : {:<12} {:<12} {:<12}'.format(q1, mp, q3))
-    logging.info('Energies  : {:.10} {:.10} {:.10}'.format(q1_e, mp_e, q3_e))
-    if q3_e >= mp_e and q3_e >= q1_e:
-        return get_ts(mp, q3, high)
-    elif mp_e >= q1_e and mp_e >= q3_e:
-        return get_ts(q1, mp, q3)
-    elif q1_e >= mp_e and q1_e >= q3_e:
-        return get_ts(low, q1, mp)
-    else:
-        raise Exception('Unknown error occured, check algorithms.py file')
+    return NEBPath.from_structures([start_struct, final_struct]).get_image(float(i - low) / (high - low))
+
+
+def get_ts_golden(low, high, target=0.01, checkpoint='get_ts_golden.json'):
+    """
+    Find TS from string of structures using a golden-section search.  The bracket is the highest interior point
+    evaluated so far and its evaluated neighbours, and each iteration evaluates one new point a golden fraction into the
+    larger side of it, so only one new energy is needed per iteration.  Every converged energy in energies.jsonl between
+    low and high is used, so a half-finished search from get_ts or an earlier run is continued from its best bracket
+    instead of started over, and a probe that lands on an existing folder reuses it through get_energy.  The bracket
+    and energies are also written to checkpoint after each step.
+
+    :param low: low end index
+    :param high: high end index
+    :param target: Convergence criteria
+    :param checkpoint: file to save progress to
+    :return: index of ts
+    """
+    state = read_checkpoint(checkpoint, 'golden', [low, high], target)
+    if state['status'] == 'converged':
+        return state['ts']
+    invphi = (5 ** 0.5 - 1) / 2
+    energies = state['energies']
+    index = EnergyIndex('.')
+    for i in index.converged:
+        if low <= i <= high and i not in energies:
+            energies[i] = index.get(i)['energy']
+
+    def evaluate(i, below, above):
+        if i not in energies:
+            state['pending'] = [i]
+            write_checkpoint(checkpoint, state)
+            energies[i] = get_energy(i, get_structure(i, below, above), target)
+            state['pending'] = []
+            write_checkpoint(checkpoint, state)
+        return energies[i]
+
+    evaluate(low, low, high)
+    evaluate(high, low, high)
+    while True:
+        known = sorted(i for i in energies if low <= i <= high)
+        if len(known) == 2:  # first interior point
+            if high - low < 2:
+                break
+            evaluate(low + max(int(round((high - low) * (1 - invphi))), 1), low, high)
+            continue
+        j = max(range(1, len(known) - 1), key=lambda k: energies[known[k]])
+        a, m, b = known[j - 1:j + 2]
+        state['bracket'] = [a, m, b]
+        write_checkpoint(checkpoint, state)
+        logging.info('Locations : {:<12} {:<12} {:<12}'.format(a, m, b))
+        logging.info('Energies  : {:.10} {:.10} {:.10}'.format(energies[a], energies[m], energies[b]))
+        state['history'].append({'locations': [a, m, b], 'energies': [energies[a], energies[m], energies[b]]})
+        if b - a <= 2 or (abs(energies[m] - energies[a]) < target and abs(energies[m] - energies[b]) < target):
+            break
+        if b - m >= m - a:  # probe the larger side of the bracket
+            evaluate(m + max(int(round((b - m) * (1 - invphi))), 1), m, b)
+        else:
+            evaluate(m - max(int(round((m - a) * (1 - invphi))), 1), a, m)
+    interior = [i for i in energies if low < i < high] or [low, high]
+    best = max(interior, key=lambda i: energies[i])
+    logging.info('Found Max at : {} with E= {:.10}'.format(best, energies[best]))
+    state['status'] = 'converged'
+    state['ts'] = best
+    write_checkpoint(checkpoint, state)
+    return best
+
+
+def gp_predict(x, y, grid, noise=1e-6):
+    """
+    Gaussian process regression with a squared-exponential kernel.  The length scale is picked from a fixed grid by
+    maximizing the marginal likelihood.
+
+    :param x: evaluated locations (scaled to [0, 1])
+    :param y: evaluated energies
+    :param grid: locations to predict at (scaled to [0, 1])
+    :param noise: variance of energy noise relative to the variance of y
+    :return: (mean, standard deviation) at grid
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    y_mean = y.mean()
+    y_std = y.std() if y.std() > 0 else 1.0
+    y_norm = (y - y_mean) / y_std
+
+    best = None
+    for length in np.logspace(-2.5, 0, 26):
+        k = np.exp(-0.5 * ((x[:, None] - x[None, :]) / length) ** 2) + (noise + 1e-10) * np.eye(len(x))
+        try:
+            chol = np.linalg.cholesky(k)
+        except np.linalg.LinAlgError:
+            continue
+        alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, y_norm))
+        likelihood = -0.5 * y_norm.dot(alpha) - np.log(np.diag(chol)).sum()
+        if best is None or likelihood > best[0]:
+            best = (likelihood, length, chol, alpha)
+    _, length, chol, alpha = best
+
+    k_grid = np.exp(-0.5 * ((grid[:, None] - x[None, :]) / length) ** 2)
+    mean = k_grid.dot(alpha)
+    v = np.linalg.solve(chol, k_grid.T)
+    var = np.clip(1 - (v ** 2).sum(axis=0), 0, None)
+    return mean * y_std + y_mean, np.sqrt(var) * y_std
+
+
+def get_ts_surrogate(low, high, target=0.01, uncertainty=0.01, kappa=2.0, noise=1e-6, max_points=100):
+    """
+    Find TS from string of structures by fitting a Gaussian process to every energy evaluated between low and high
+    (including ones already in energies.jsonl) and evaluating next where mean + kappa * std is highest.
+
+    Stops when the best evaluated point is within target of its evaluated neighbours, when no point can be more than
+    uncertainty above the best evaluated energy, or when the next point has already been evaluated.
+
+    :param low: low end index
+    :param high: high end index
+    :param target: Convergence criteria
+    :param uncertainty: model uncertainty (eV) to stop at
+    :param kappa: weight of the model standard deviation when choosing the next point
+    :param noise: variance of energy noise relative to the variance of the energies (raise for rough paths)
+    :param max_points: maximum number of energies to evaluate
+    :return: index of ts
+    """
+    index = EnergyIndex('.')
+    energies = {i: index.get(i)['energy'] for i in index.converged if low <= i <= high}
+    mp = int((low + high) / 2)
+    for i, below, above in [(low, low, high), (high, low, high), (mp, low, high)]:
+        if i not in energies:
+            energies[i] = get_energy(i, get_structure(i, below, above), target)
+
+    grid = np.arange(low, high + 1)
+    for _ in range(max_points):
+        evaluated = sorted(energies)
+        best = max(evaluated, key=lambda i: energies[i])
+        j = evaluated.index(best)
+        neighbors = [energies[i] for i in evaluated[max(j - 1, 0):j + 2] if i != best]
+        if neighbors and all(abs(energies[best] - e) < target for e in neighbors):
+            logging.info('Converged to target at : {}'.format(best))
+            break
+
+        scale = float(high - low)
+        mean, std = gp_predict([(i - low) / scale for i in evaluated], [energies[i] for i in evaluated],
+                               (grid - low) / scale, noise)
+        acquisition = mean + kappa * std
+        nxt = int(grid[np.argmax(acquisition)])
+        logging.info('Model max at : {} with E= {:.10} +/- {:.3}'.format(
+            int(grid[np.argmax(mean)]), float(mean.max()), float(std[np.argmax(mean)])))
+        if acquisition.max() - energies[best] < uncertainty:
+            logging.info('Converged to model uncertainty at : {}'.format(best))
+            break
+        if nxt in energies:
+            logging.info('Converged due to lack of resolution at : {}'.format(best))
+            break
+
+        below = max([i for i in evaluated if i < nxt])
+        above = min([i for i in evaluated if i > nxt])
+        logging.info('Converging : {}'.format(nxt))
+        energies[nxt] = get_energy(nxt, get_structure(nxt, below, above), target)
+
+    best = max(energies, key=lambda i: energies[i])
+    logging.info('Found Max at : {} with E= {:.10}'.format(best, energies[best]))
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', help='folder set up by prepare_energy to run VASP in (default: ".")',
+                        default='.', nargs='?')
+    parser.add_argument('-n', '--nprocs', help='number of MPI ranks to run VASP on (default: whole allocation)',
+                        type=int, default=None)
+    parser.add_argument('--hostfile', help='hosts for mpirun to start the ranks on (default: let mpirun choose)',
+                        default=None)
+    args = parser.parse_args()
+    run_vasp(args.directory, args.nprocs, args.hostfile)
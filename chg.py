@@ -3,22 +3,32 @@
 Script to split CHGCAR into its components along the axes
 """
 import argparse
-from pymatgen.io.vasp.outputs import *
+import numpy as np
+from ChgcarReader import ChgcarReader
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-f', '--file', type=str, default='CHGCAR')
 parser.add_argument('-d', '--derivative', action='store_true')
 args = parser.parse_args()
 
-c = Chgcar.from_file(args.file)
+c = ChgcarReader(args.file)
+abc = c.structure.lattice.abc
+
+# averages along every axis in one pass over the planes of the file
+sums = [np.zeros(n) for n in c.shape]
+for start, block in c.iter_planes(16):
+    sums[0] += block.sum((1, 2))
+    sums[1] += block.sum((0, 2))
+    sums[2][start:start + block.shape[2]] = block.sum((0, 1))
+averages = [total * n / c.ngridpts for total, n in zip(sums, c.shape)]
 basename = args.file.lower() if not args.derivative else args.file.lower() + '.d'
 
 # iterate over each axis
 for v in range(3):
     with open(basename + '.' + str(v) + '.txt', 'w') as file_to_write:
         if args.derivative:
-            f = c.get_average_along_axis(v)
-            h = c.get_axis_grid(v)[1]
+            f = averages[v]
+            h = abc[v] / c.shape[v]
             length = len(f)
 
             # get spherical charge data
@@ -28,4 +38,4 @@ for v in range(3):
             # write file
             file_to_write.writelines([str(x) + '\n' for x in lines])
         else:
-            file_to_write.writelines([str(x) + '\n' for x in c.get_average_along_axis(v)])
+            file_to_write.writelines([str(x) + '\n' for x in averages[v]])
@@ -1,15 +1,17 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import argparse
+import json
 import subprocess
 import numpy as np
 import sys
 import os
-from pymatgen.io.vasp.outputs import Chgcar
+from concurrent.futures import ProcessPoolExecutor
+from ChgcarReader import ChgcarReader
 from Classes_Pymatgen import Poscar, Potcar
-from File_Management import file_to_dict
 
 def dipole_acf(args):
+    from File_Management import file_to_dict
     poscar = Poscar.from_file('POSCAR')
     potcar = Potcar.from_file('POTCAR')
     natoms = poscar.natoms
@@ -40,17 +42,74 @@ def dipole_acf(args):
     print('Dipole = ' + str(float(dipole) / 0.20819434) + ' D')
     return float(dipole)
 
+def get_fractional_axes(shape, origin=(0, 0, 0)):
+    # Fractional coordinate of each grid index along a, b and c, measured from the grid point nearest origin
+    axes = []
+    for n, o in zip(shape, origin):
+        shift = int(np.round(float(n) * o))
+        axes.append(((np.arange(n) - shift) % n) / float(n))
+    return axes
+
+def get_moments(data, lattice, origin=(0, 0, 0), quadrupole=False):
+    """
+    Net charge, dipole vector and optionally the traceless quadrupole tensor of charge on a grid, in one pass over
+    its planes.  Moments have the sign of data.
+
+    :param data: (na, nb, nc) charge of each grid point (e)
+    :param lattice: (3, 3) lattice vectors as rows
+    :param origin: fractional coordinates of the origin; the cell is wrapped around it
+    :param quadrupole: also compute the quadrupole, sum of q (3 r r - r^2 I)
+    :return: dict with charge (e), dipole (3, eA) and quadrupole (3 x 3, eA^2) as np.arrays
+    """
+    fa, fb, fc = get_fractional_axes(data.shape, origin)
+    # Fractional coordinates are separable in a, b and c, so only sums over lines and planes of the grid are needed
+    sums_ab = np.empty(data.shape[:2])
+    sums_ac = np.empty((data.shape[0], data.shape[2]))
+    sums_bc = np.zeros(data.shape[1:])
+    for i, plane in enumerate(data):
+        sums_ab[i] = plane.sum(1)
+        sums_ac[i] = plane.sum(0)
+        if quadrupole:
+            sums_bc += plane
+    sums_a, sums_b, sums_c = sums_ab.sum(1), sums_ab.sum(0), sums_ac.sum(0)
+    moments = {'charge': sums_a.sum(),
+               'dipole': np.dot([np.dot(fa, sums_a), np.dot(fb, sums_b), np.dot(fc, sums_c)], lattice)}
+    if quadrupole:
+        second = np.diag([np.dot(fa ** 2, sums_a), np.dot(fb ** 2, sums_b), np.dot(fc ** 2, sums_c)])
+        second[0, 1] = second[1, 0] = np.dot(fa, np.dot(sums_ab, fb))
+        second[0, 2] = second[2, 0] = np.dot(fa, np.dot(sums_ac, fc))
+        second[1, 2] = second[2, 1] = np.dot(fb, np.dot(sums_bc, fc))
+        second = np.dot(lattice.T, np.dot(second, lattice))  # sum of q r r in cartesian coordinates
+        moments['quadrupole'] = 3 * second - np.trace(second) * np.eye(3)
+    return moments
+
+def get_unit_vector(axis, lattice):
+    # Cartesian unit vector along axis given in fractional coordinates
+    cart_axis = np.dot(axis, lattice)
+    return cart_axis / np.linalg.norm(cart_axis)
+
+def print_moments(moments):
+    print('Dipole = ' + str(moments['dipole_axis']) + ' eA')
+    print('Dipole = ' + str(moments['dipole_axis'] / 0.20819434) + ' D')
+    print('Dipole vector = ' + str(moments['dipole']) + ' eA')
+    if 'quadrupole' in moments:
+        print('Quadrupole =\n' + str(moments['quadrupole']) + ' eA^2')
+
 def dipole_chgcar(args):
+    """
+    Dipole of the Bader volumes summed in BvAt_summed.dat with the cores of args.atoms, corrected for net charge
+
+    :param args: namespace with atoms, axis, origin and (optionally) quadrupole
+    :return: dict of get_moments plus dipole_axis, the dipole along args.axis (eA)
+    """
     # Getting info about the cell
     print('Getting Electron Densities...', end='')
     sys.stdout.flush()
-    chg = Chgcar.from_file('BvAt_summed.dat')
+    chg = ChgcarReader('BvAt_summed.dat')
     s = chg.structure
-    d = chg.data['total'] / chg.ngridpts   # get charge density in e-/A^2
-    lengths = []
-    for i in range(3):
-        lengths.append(len(chg.get_axis_grid(i)))
-    lengths = np.array(lengths)
+    d = chg.read()['total']
+    d /= chg.ngridpts   # get charge density in e-/A^2
+    lengths = np.array(chg.shape)
     print('done')
 
     # Adding ionic centers to cell
@@ -66,123 +125,84 @@ def dipole_chgcar(args):
         site = s.sites[atom - 1] # atoms are 1 indexed
         # number = site.species_and_occu.elements[0].number
         i = np.round(np.array([site.a, site.b, site.c]) * lengths)  # getting indecies to place atomic charges in cell
-        d[i[0] % lengths[0]][i[1] % lengths[1]][i[2] % lengths[2]] -= (charge)  # placing ionic centers in cell
+        d[int(i[0] % lengths[0])][int(i[1] % lengths[1])][int(i[2] % lengths[2])] -= (charge)  # placing ionic centers in cell
     print('done')
 
     # Make correction for charged species
     print('Calculating Correction for Charged Species...', end='')
     sys.stdout.flush()
-    element_charge = sum(sum(sum(d)))
-    bader_gridpts = len(np.nonzero(d)[2])# number of gridpoints in bader volume
+    element_charge = d.sum()
+    bader_gridpts = np.count_nonzero(d)  # number of gridpoints in bader volume
     correction = element_charge / bader_gridpts  # normalization constant to account for charged species
     print('done')
     print('\nCharge = ' + str(-element_charge) + ' e-\n')
     # print('\nCorrection = ' + str(correction) + ' e-\n')
 
-    # Calculating lattice
-    #axis = np.array(args.axis) # / np.linalg.norm(np.array(args.axis))
-    cart_axis = np.matrix(args.axis) * s.lattice.matrix
-    unit_vector = cart_axis / np.linalg.norm((cart_axis))
-    a_axis = chg.get_axis_grid(0)
-    b_axis = chg.get_axis_grid(1)
-    c_axis = chg.get_axis_grid(2)
-    len_a = len(a_axis)
-    len_b = len(b_axis)
-    len_c = len(c_axis)
-    mod_a = int(np.round(float(len_a) * args.origin[0]))
-    mod_b = int(np.round(float(len_b) * args.origin[1]))
-    mod_c = int(np.round(float(len_c) * args.origin[2]))
-    mat = s.lattice.matrix
-    def get_first_moment(a, b, c, x):
-        a = float((a - mod_a) % len_a) / len_a
-        b = float((b - mod_b) % len_b) / len_b
-        c = float((c - mod_c) % len_c) / len_c
-        cart_vector = np.matrix([a, b, c]) * mat
-        return float(np.dot(cart_vector, unit_vector.transpose())) * (x - correction)
-
     # integrate over charge density
-    print('Calculating Dipole... ')
+    print('Calculating Dipole...', end='')
     sys.stdout.flush()
-    dipole = 0
-    for a in range(lengths[0]):
-        sys.stdout.write('\r%d percent' % int(a * 100 / len_a))
-        sys.stdout.flush()
-        for b in range(lengths[1]):
-            for c in range(lengths[2]):
-                x = d[a][b][c]
-                if x != 0:
-                    dipole += get_first_moment(a, b, c, x)
+    moments = get_moments(np.where(d != 0, d - correction, 0), s.lattice.matrix, args.origin,
+                          getattr(args, 'quadrupole', False))
+    moments['dipole_axis'] = float(np.dot(moments['dipole'], get_unit_vector(args.axis, s.lattice.matrix)))
     print('done')
-    print('Dipole = ' + str(dipole) + ' eA')
-    print('Dipole = ' + str(dipole / 0.20819434) + ' D')
-    return dipole
-    sys.stdout.flush()
+    print_moments(moments)
+    return moments
 
 def get_chg_matrix(folder):
-    chg = Chgcar.from_file(os.path.join(folder, 'CHGCAR'))
-    chg_matrix = chg.data['total'] / chg.ngridpts
+    """
+    :param folder: VASP run folder with CHGCAR, POTCAR and POSCAR
+    :return: charge of each grid point with the ion cores added (e, positive for ions)
+    """
+    chg = ChgcarReader(os.path.join(folder, 'CHGCAR'))
+    chg_matrix = chg.read()['total']
+    chg_matrix /= chg.ngridpts
     potcar = Potcar.from_file(os.path.join(folder, 'POTCAR'))
     poscar = Poscar.from_file(os.path.join(folder, 'POSCAR'))
-    natoms = poscar.natoms
-    cumm_natoms = np.array([sum(natoms[0:i + 1]) for i in range(len(natoms))])
-
-    lengths = []
-    for i in range(3):
-        lengths.append(len(chg.get_axis_grid(i)))
-    lengths = np.array(lengths)
+    charges = np.repeat([potcarsingle.nelectrons for potcarsingle in potcar], poscar.natoms)
 
-    for atom in range(len(chg.structure.sites)):  # iterating over ion centers
-        potcarsingle = potcar[np.argmax(cumm_natoms >= (atom+1))]  # get Potcarsingle for each atom
-        charge = potcarsingle.nelectrons
-        site = chg.structure.sites[atom]  # atoms are 1 indexed
-        # number = site.species_and_occu.elements[0].number
-        i = np.round(np.array([site.a, site.b, site.c]) * lengths)  # getting indecies to place atomic charges in cell
-        chg_matrix[int(i[0] % lengths[0])][int(i[1] % lengths[1])][int(i[2] % lengths[2])] -= (charge)  # placing ionic centers in cell
+    lengths = np.array(chg_matrix.shape)
+    indices = np.round(chg.structure.frac_coords * lengths).astype(int) % lengths  # grid point nearest each ion
+    np.subtract.at(chg_matrix, tuple(indices.T), charges)  # placing ionic centers in cell, ions may share a point
 
     return -chg_matrix
 
-def dipole_chgcars(dipole_folder, reference_folder):
-    print('Getting Electron Densities (dipole)...', end='', flush=True)
-    dipole_matrix = get_chg_matrix(dipole_folder)
-    print('done')
-
-    print('Getting Electron Densities (reference)...', end='', flush=True)
-    reference_matrix   = get_chg_matrix(reference_folder)
+def get_chg_moments(folder, lattice, origin=(0, 0, 0), quadrupole=False):
+    """
+    get_moments of get_chg_matrix(folder), so a worker process only sends back the moments and not the whole grid
+
+    :param folder: VASP run folder with CHGCAR, POTCAR and POSCAR
+    :param lattice: (3, 3) lattice vectors as rows
+    :param origin: fractional coordinates of the origin; the cell is wrapped around it
+    :param quadrupole: also compute the traceless quadrupole tensor
+    :return: (shape of the grid, dict of get_moments)
+    """
+    chg_matrix = get_chg_matrix(folder)
+    return chg_matrix.shape, get_moments(chg_matrix, lattice, origin, quadrupole)
+
+def dipole_chgcars(dipole_folder, reference_folder, axis, origin=(0, 0, 0), quadrupole=False):
+    """
+    Dipole of the difference in charge (electrons and ion cores) between two runs of the same cell
+
+    :param dipole_folder: folder with CHGCAR, POTCAR and POSCAR
+    :param reference_folder: folder with CHGCAR, POTCAR and POSCAR on the same grid
+    :param axis: direction of the dipole in fractional coordinates
+    :param origin: fractional coordinates of the origin; the cell is wrapped around it
+    :param quadrupole: also compute the traceless quadrupole tensor
+    :return: dict of get_moments plus dipole_axis, the dipole along axis (eA)
+    """
     s = Poscar.from_file(os.path.join(reference_folder, 'POSCAR')).structure
+    print('Calculating Dipole...', end='', flush=True)
+    # The moments are linear in the charge, so those of the difference are the difference of the moments of each run
+    with ProcessPoolExecutor(2) as pool:
+        (dipole_shape, dipole_moments), (reference_shape, reference_moments) = pool.map(
+            get_chg_moments, [dipole_folder, reference_folder], [s.lattice.matrix] * 2, [origin] * 2, [quadrupole] * 2)
+    if dipole_shape != reference_shape:
+        raise ValueError('CHGCAR grids of {} and {} do not match'.format(dipole_folder, reference_folder))
+    moments = {key: dipole_moments[key] - reference_moments[key] for key in dipole_moments}
+    moments['dipole_axis'] = float(np.dot(moments['dipole'], get_unit_vector(axis, s.lattice.matrix)))
     print('done')
-
-
-    cart_axis = np.matrix(args.axis) * s.lattice.matrix
-    unit_vector = cart_axis / np.linalg.norm((cart_axis))
-    len_a = len(dipole_matrix)
-    len_b = len(dipole_matrix[0])
-    len_c = len(dipole_matrix[0][0])
-    mod_a = int(np.round(float(len_a) * args.origin[0]))
-    mod_b = int(np.round(float(len_b) * args.origin[1]))
-    mod_c = int(np.round(float(len_c) * args.origin[2]))
-    mat = s.lattice.matrix
-
-    def get_first_moment(a, b, c, x):
-        a = float((a - mod_a) % len_a) / len_a
-        b = float((b - mod_b) % len_b) / len_b
-        c = float((c - mod_c) % len_c) / len_c
-        cart_vector = np.matrix([a, b, c]) * mat
-        return float(np.dot(cart_vector, unit_vector.transpose())) * x
-
-    print('Calculating Dipole...')
-    diff = dipole_matrix - reference_matrix
-    dipole = 0
-    for a in range(len_a):
-        sys.stdout.write('\r%d percent' % int(a * 100 / len_a))
-        sys.stdout.flush()
-        for b in range(len_b):
-            for c in range(len_c):
-                dipole += get_first_moment(a, b, c, diff[a][b][c])
-    print('done')
-    print('Dipole = ' + str(dipole) + ' eA')
-    print('Dipole = ' + str(dipole / 0.20819434) + ' D')
-    return dipole
-
+    print_moments(moments)
+    return moments
 
 
 if __name__ == '__main__':
@@ -200,14 +220,16 @@ if __name__ == '__main__':
                         type=float, nargs=3, default=[0,0,0])
     parser.add_argument('--acf', help='Calculate dipole using ACF.dat',
                         action='store_true')
+    parser.add_argument('-q', '--quadrupole', help='Also calculate the traceless quadrupole tensor (written to dipole.json)',
+                        action='store_true')
     args = parser.parse_args()
 
 
 
     if args.acf:
-        dipole = dipole_acf(args)
+        moments = {'dipole_axis': dipole_acf(args)}
     elif args.dipole and args.reference:
-        dipole = dipole_chgcars(args.dipole, args.reference)
+        moments = dipole_chgcars(args.dipole, args.reference, args.axis, args.origin, args.quadrupole)
     else:
         if not args.no_calc:
             p = subprocess.Popen(['chgsum.pl', 'AECCAR0', 'AECCAR2'])
@@ -215,9 +237,10 @@ if __name__ == '__main__':
             p = subprocess.Popen(
                 ['bader', 'CHGCAR', '-ref', 'CHGCAR_sum', '-p', 'sum_atom'] + [str(x) for x in args.atoms])
             p.wait()
-        dipole = dipole_chgcar(args)
+        moments = dipole_chgcar(args)
+    dipole = moments['dipole_axis']
     with open('dipole.dat', 'w') as dip_file:
         dip_file.write('Dipole = ' + str(dipole) + ' eA\nDipole = ' + str(dipole / 0.20819434) + ' D')
-
-
-
+    with open('dipole.json', 'w') as f:
+        json.dump(dict({key: np.asarray(value).tolist() for key, value in moments.items()}, axis=args.axis,
+                       origin=args.origin, units={'charge': 'e', 'dipole': 'eA', 'quadrupole': 'eA^2'}), f, indent=2)
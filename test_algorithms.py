@@ -0,0 +1,95 @@
+import os
+import algorithms
+from Benchmark_TS import SURFACES, AnalyticPES, get_structure
+
+
+class Stop(Exception):
+    pass
+
+
+def setup_search(directory, surface_name):
+    # Endpoint folders of a search on an analytic surface, as Benchmark_TS.benchmark makes them
+    surface, start, final = SURFACES[surface_name]
+    for i, position in [(0, start), (9999, final)]:
+        os.makedirs(os.path.join(directory, str(i).zfill(4)))
+        algorithms.Poscar(get_structure(position)).write_file(os.path.join(directory, str(i).zfill(4), 'POSCAR'))
+        with open(os.path.join(directory, str(i).zfill(4), 'energy.txt'), 'w') as f:
+            f.write(str(surface(*position)))
+    return surface
+
+
+def test_golden_resumes_ternary_search(tmp_path, monkeypatch):
+    surface = setup_search(str(tmp_path), 'double_well')
+    monkeypatch.chdir(tmp_path)
+    ternary = AnalyticPES(surface)
+
+    def stopped(i, structure):  # the job runs out of time after five points
+        if len(ternary.calls) == 5:
+            raise Stop()
+        return ternary(i, structure)
+
+    algorithms.set_energy_backend(stopped)
+    try:
+        try:
+            algorithms.get_ts(0, 4999, 9999)
+        except Stop:
+            pass
+        golden = AnalyticPES(surface)
+        algorithms.set_energy_backend(golden)
+        ts = algorithms.get_ts_golden(0, 9999)
+    finally:
+        algorithms.set_energy_backend(None)
+    assert not set(golden.calls) & set(ternary.calls)
+    assert len(golden.calls) <= 3
+    assert abs(ts - 4999) < 600
+
+
+def test_ts_resumes_from_checkpoint(tmp_path, monkeypatch):
+    surface = setup_search(str(tmp_path / 'full'), 'muller_brown')
+    setup_search(str(tmp_path / 'stopped'), 'muller_brown')
+    full = AnalyticPES(surface)
+    first = AnalyticPES(surface)
+
+    def stopped(i, structure):
+        if len(first.calls) == 4:
+            raise Stop()
+        return first(i, structure)
+
+    second = AnalyticPES(surface)
+    try:
+        monkeypatch.chdir(tmp_path / 'full')
+        algorithms.set_energy_backend(full)
+        ts = algorithms.get_ts(0, 4999, 9999)
+        monkeypatch.chdir(tmp_path / 'stopped')
+        algorithms.set_energy_backend(stopped)
+        try:
+            algorithms.get_ts(0, 4999, 9999)
+        except Stop:
+            pass
+        algorithms.set_energy_backend(second)
+        assert algorithms.get_ts(0, 4999, 9999) == ts
+    finally:
+        algorithms.set_energy_backend(None)
+    assert not set(first.calls) & set(second.calls)
+    assert first.calls + second.calls == full.calls
+
+
+def test_split_allocation_gives_each_run_its_own_hosts(tmp_path, monkeypatch):
+    nodefile = tmp_path / 'nodefile'
+    nodefile.write_text('n1\n' * 4 + 'n2\n' * 4)
+    monkeypatch.setenv('PBS_NODEFILE', str(nodefile))
+    monkeypatch.setenv('VASP_MPI', 'mpirun')
+    assert algorithms.split_allocation(2) == [(4, ['n1'] * 4), (4, ['n2'] * 4)]
+    assert [n for n, _ in algorithms.split_allocation(3)] == [3, 3, 2]
+    assert len(algorithms.split_allocation(20)) == 8  # at most one run per rank
+
+    monkeypatch.setenv('VASP_KPTS', 'vasp_std')
+    assert algorithms.get_vasp_command({}, 4, str(tmp_path / 'hostfile')) == \
+        ['mpirun', '-np', '4', '-machinefile', str(tmp_path / 'hostfile'), 'vasp_std']
+
+    monkeypatch.delenv('PBS_NODEFILE')
+    assert algorithms.split_allocation(2) is None
+    monkeypatch.setenv('VASP_MPI', 'srun')
+    monkeypatch.setenv('SLURM_NTASKS', '8')
+    monkeypatch.delenv('PBS_NP', raising=False)
+    assert algorithms.split_allocation(2) == [(4, []), (4, [])]
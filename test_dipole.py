@@ -0,0 +1,35 @@
+import numpy as np
+from dipole import get_moments, get_fractional_axes
+
+
+def get_moments_by_point(data, lattice, origin):
+    # Moments summed over every grid point, for comparison
+    fa, fb, fc = get_fractional_axes(data.shape, origin)
+    r = np.dot(np.stack(np.meshgrid(fa, fb, fc, indexing='ij'), -1), lattice)
+    second = np.einsum('abc,abci,abcj->ij', data, r, r)
+    return {'charge': data.sum(), 'dipole': np.einsum('abc,abci->i', data, r),
+            'quadrupole': 3 * second - np.trace(second) * np.eye(3)}
+
+
+def test_moments_match_sum_over_grid():
+    rng = np.random.RandomState(0)
+    data = rng.rand(6, 7, 8)
+    lattice = np.array([[5, 0, 0], [1, 6, 0], [0.5, 0.3, 7]])
+    origin = (0.25, 0.6, 0.1)
+    moments = get_moments(data, lattice, origin, quadrupole=True)
+    expected = get_moments_by_point(data, lattice, origin)
+    for key in ['charge', 'dipole', 'quadrupole']:
+        assert np.allclose(moments[key], expected[key])
+    assert abs(np.trace(moments['quadrupole'])) < 1e-8
+
+
+def test_moments_of_difference_are_difference_of_moments():
+    # dipole_chgcars takes the moments of each run in its own process and subtracts them
+    rng = np.random.RandomState(1)
+    data_1, data_2 = rng.rand(5, 6, 7), rng.rand(5, 6, 7)
+    lattice = np.diag([4.0, 5.0, 6.0])
+    moments = get_moments(data_1 - data_2, lattice, (0.5, 0, 0), quadrupole=True)
+    moments_1 = get_moments(data_1, lattice, (0.5, 0, 0), quadrupole=True)
+    moments_2 = get_moments(data_2, lattice, (0.5, 0, 0), quadrupole=True)
+    for key in ['charge', 'dipole', 'quadrupole']:
+        assert np.allclose(moments[key], moments_1[key] - moments_2[key])
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+from pymatgen.core import Structure, Lattice
+from pymatgen.io.vasp.inputs import Poscar
+from FileTools import interpolate_chgcar, seed_file, seed_tree
+from ChgcarReader import ChgcarReader
+
+
+def write_chgcar(filename, structure, data):
+    # CHGCAR with the grid in file order (a fastest), five values to a line
+    values = data.T.reshape(-1)
+    with open(filename, 'w') as f:
+        f.write(Poscar(structure).get_string() + '\n')
+        f.write('   {}   {}   {}\n'.format(*data.shape))
+        for i in range(0, len(values), 5):
+            f.write((' %17.11E' * len(values[i:i + 5]) + '\n') % tuple(values[i:i + 5]))
+    return filename
+
+
+def get_structure(x):
+    return Structure(Lattice.cubic(4), ['H', 'O'], [[x, 0, 0], [0.5, 0.5, 0.5]])
+
+
+def test_interpolate_chgcar_values(tmp_path):
+    data_1 = np.arange(2 * 3 * 4, dtype=float).reshape(2, 3, 4) + 1
+    data_2 = 3 * data_1
+    start = write_chgcar(str(tmp_path / 'CHGCAR_1'), get_structure(0), data_1)
+    final = write_chgcar(str(tmp_path / 'CHGCAR_2'), get_structure(0.2), data_2)
+    outputs = [str(tmp_path / 'CHGCAR_{}'.format(i)) for i in range(3)]
+    interpolate_chgcar(start, final, [0, 0.25, 0.5], outputs)
+    for fraction, output in zip([0, 0.25, 0.5], outputs):
+        reader = ChgcarReader(output)
+        assert reader.shape == (2, 3, 4)
+        assert np.allclose(reader.read()['total'], data_1 + fraction * (data_2 - data_1))
+        assert np.allclose(reader.structure.frac_coords, get_structure(0).frac_coords)
+
+
+def test_interpolate_chgcar_header_has_no_selective_dynamics(tmp_path):
+    data = np.ones((2, 2, 2))
+    start = write_chgcar(str(tmp_path / 'CHGCAR_1'), get_structure(0), data)
+    final = write_chgcar(str(tmp_path / 'CHGCAR_2'), get_structure(0.2), 2 * data)
+    structure = get_structure(0.1)
+    structure.add_site_property('selective_dynamics', [[True] * 3, [False] * 3])
+    output = str(tmp_path / 'CHGCAR')
+    interpolate_chgcar(start, final, [0.5], [output], structures=[structure])
+    with open(output) as f:
+        text = f.read()
+    assert 'selective' not in text.lower()
+    assert ' T ' not in text and ' F ' not in text
+    reader = ChgcarReader(output)
+    assert np.allclose(reader.structure.frac_coords, get_structure(0.1).frac_coords)
+    assert np.allclose(reader.read()['total'], 1.5)
+    assert 'selective_dynamics' in structure.site_properties
+
+
+def test_seed_tree_hardlinks(tmp_path):
+    above = tmp_path / 'above'
+    os.makedirs(str(above / 'sub'))
+    for name in ['WAVECAR', 'CHGCAR', os.path.join('sub', 'vasprun.xml')]:
+        (above / name).write_text(name)
+    below = seed_tree(str(above), str(tmp_path / 'below'), hardlink=True)
+    for name in ['WAVECAR', 'CHGCAR', os.path.join('sub', 'vasprun.xml')]:
+        assert os.path.samefile(str(above / name), os.path.join(below, name))
+
+
+def test_seed_file_copies_without_hardlink(tmp_path):
+    (tmp_path / 'WAVECAR').write_text('wavefunctions')
+    os.makedirs(str(tmp_path / 'run'))
+    dst = seed_file(str(tmp_path / 'WAVECAR'), str(tmp_path / 'run'))
+    assert dst == str(tmp_path / 'run' / 'WAVECAR')
+    assert not os.path.samefile(str(tmp_path / 'WAVECAR'), dst)
+    with open(dst) as f:
+        assert f.read() == 'wavefunctions'
@@ -0,0 +1,86 @@
+import sys
+import types
+import numpy as np
+from pymatgen.core import Structure, Lattice
+from Helpers import get_supercells_without, get_smallest_expansion, pmg_to_pyl, pyl_to_pmg
+
+
+def same_lattice(matrix_1, matrix_2):
+    # Integer lattices (rows) are the same if each basis is an integer combination of the other
+    return all(np.allclose(np.round(x), x) for x in [np.linalg.solve(matrix_2.T, matrix_1.T),
+                                                      np.linalg.solve(matrix_1.T, matrix_2.T)])
+
+
+def count_distinct(matrices):
+    distinct = []
+    for matrix in matrices:
+        if not any(same_lattice(matrix, other) for other in distinct):
+            distinct.append(matrix)
+    return len(distinct)
+
+
+def test_supercells_are_every_sublattice_once():
+    # Number of sublattices of index n of a 3D lattice
+    for n, count in [(1, 1), (2, 7), (3, 13), (4, 35), (6, 91)]:
+        matrices = get_supercells_without(np.zeros((0, 3), dtype=np.int64), n)
+        assert len(matrices) == count
+        assert count_distinct(matrices) == count
+
+
+def test_smallest_expansion_finds_bcc_supercell():
+    # The 4 cell bcc supercell [[2, 0, 0], [0, 2, 0], [1, 1, 1]] of simple cubic has no vector shorter than 5.196 A
+    structure = Structure(Lattice.cubic(3), ['Po'], [[0, 0, 0]])
+    expansion = get_smallest_expansion(structure, 5)
+    assert len(expansion) == 4
+    assert min(expansion.lattice.abc) >= 5
+
+
+class PylAtom:
+    # Stand-in for pylada.crystal.Atom: pos, type and any keyword as attributes
+    def __init__(self, x, y, z, type, **kwargs):
+        self.pos = np.array([x, y, z])
+        self.type = type
+        self.__dict__.update(kwargs)
+
+
+class PylStructure(list):
+    # Stand-in for pylada.crystal.Structure: cell as columns, to_dict keyed by atom index
+    def __init__(self, cell):
+        super().__init__()
+        self.cell = np.array(cell)
+
+    def add_atom(self, atom):
+        self.append(atom)
+        return self
+
+    def to_dict(self):
+        d = {'cell': self.cell}
+        for i, atom in enumerate(self):
+            d[i] = dict(vars(atom))
+        return d
+
+
+def test_pylada_round_trip_keeps_selective_dynamics(monkeypatch):
+    crystal = types.ModuleType('pylada.crystal')
+    crystal.Atom, crystal.Structure = PylAtom, PylStructure
+    pylada = types.ModuleType('pylada')
+    pylada.crystal = crystal
+    monkeypatch.setitem(sys.modules, 'pylada', pylada)
+    monkeypatch.setitem(sys.modules, 'pylada.crystal', crystal)
+
+    lattice = Lattice([[4, 0, 0], [1, 5, 0], [0, 0.5, 6]])
+    structure = Structure(lattice, ['Fe', 'O', 'O'], [[0, 0, 0], [0.5, 0.25, 0.1], [0.2, 0.7, 0.6]],
+                          site_properties={'selective_dynamics': [[True, True, True], [False, True, False],
+                                                                  [False, False, False]],
+                                           'magmom': [4, 0, 0]})
+    pyl = pmg_to_pyl(structure)
+    assert np.allclose(pyl.cell, lattice.matrix.T)
+    assert [atom.freeze for atom in pyl] == ['', 'xz', 'xyz']
+    assert [atom.magmom for atom in pyl] == [4, 0, 0]
+
+    back = pyl_to_pmg(pyl)
+    assert [site.species_string for site in back] == ['Fe', 'O', 'O']
+    assert np.allclose(back.lattice.matrix, lattice.matrix)
+    assert np.allclose(back.cart_coords, structure.cart_coords)
+    assert back.site_properties['selective_dynamics'] == structure.site_properties['selective_dynamics']
+    assert back.site_properties['magmom'] == [4, 0, 0]
@@ -0,0 +1,49 @@
+import os
+from OutcarScanner import OutcarScanner
+
+
+def get_outcar(start, times):
+    # OUTCAR header with VASP's start time, NELECT and one LOOP line per electronic step
+    lines = [' vasp.5.4.4.18Apr17-6-g9f103f2a35 (build Sep 18 2018 16:57:57) complex\n',
+             ' executed on             LinuxIFC date 2020.01.01  {}\n'.format(start),
+             '   NELECT =      48.0000    total number of electrons\n']
+    lines += ['      LOOP:  cpu time      1.0000: real time      {:.4f}\n'.format(t) for t in times]
+    return ''.join(lines)
+
+
+def test_scan_reads_only_new_lines(tmp_path):
+    outcar = str(tmp_path / 'OUTCAR')
+    with open(outcar, 'w') as f:
+        f.write(get_outcar('12:00:00', [1, 2]))
+    scanner = OutcarScanner(outcar).scan()
+    assert scanner.nelect == 48
+    assert scanner.loop_times == [1, 2]
+    offset = scanner.offset
+    with open(outcar, 'a') as f:
+        f.write('      LOOP:  cpu time      1.0000: real time      3.0000\n      LOOP:  cpu time')
+    scanner.scan()
+    assert scanner.offset > offset
+    assert scanner.loop_times == [1, 2, 3]  # the unfinished line is left for the next scan
+
+
+def test_scan_starts_over_on_a_new_file(tmp_path):
+    outcar = str(tmp_path / 'OUTCAR')
+    with open(outcar, 'w') as f:
+        f.write(get_outcar('12:00:00', [1, 2]))
+    scanner = OutcarScanner(outcar).scan()
+    # VASP restarted: a new file that has already grown past the old offset
+    with open(outcar + '.new', 'w') as f:
+        f.write(get_outcar('13:00:00', [5, 6, 7, 8]))
+    os.replace(outcar + '.new', outcar)
+    assert scanner.scan().loop_times == [5, 6, 7, 8]
+
+
+def test_scan_starts_over_on_a_rewritten_file(tmp_path):
+    outcar = str(tmp_path / 'OUTCAR')
+    with open(outcar, 'w') as f:
+        f.write(get_outcar('12:00:00', [1, 2]))
+    scanner = OutcarScanner(outcar).scan()
+    # VASP restarted in place: same inode, truncated and written again past the old offset
+    with open(outcar, 'w') as f:
+        f.write(get_outcar('13:00:00', [5, 6, 7, 8]))
+    assert scanner.scan().loop_times == [5, 6, 7, 8]